@@ -4,6 +4,22 @@ import random
 import sys
 import re
 import math
+import gc
+import os
+import bisect
+import argparse
+import http.server
+import json
+import socket
+import socketserver
+import heapq
+import queue
+import select
+import fnmatch
+import concurrent.futures
+import contextlib
+import ctypes
+import ctypes.util
 import tkinter as tk
 from tkinter import messagebox
 from tkinter import StringVar, IntVar
@@ -23,45 +39,405 @@ def ms_to_sec(ms):
 def clamp(v, a, b):
     return max(a, min(b, v))
 
+KEY_NAMES = {
+    'enter': Key.enter, 'return': Key.enter, 'space': Key.space, 'tab': Key.tab,
+    'esc': Key.esc, 'escape': Key.esc, 'backspace': Key.backspace,
+    'shift': Key.shift, 'ctrl': Key.ctrl, 'control': Key.ctrl, 'alt': Key.alt,
+    'cmd': Key.cmd, 'super': Key.cmd, 'win': Key.cmd, 'capslock': Key.caps_lock,
+    'up': Key.up, 'down': Key.down, 'left': Key.left, 'right': Key.right,
+    'home': Key.home, 'end': Key.end, 'pageup': Key.page_up, 'pagedown': Key.page_down,
+    'insert': Key.insert, 'delete': Key.delete,
+    'f1': Key.f1, 'f2': Key.f2, 'f3': Key.f3, 'f4': Key.f4,
+    'f5': Key.f5, 'f6': Key.f6, 'f7': Key.f7, 'f8': Key.f8,
+    'f9': Key.f9, 'f10': Key.f10, 'f11': Key.f11, 'f12': Key.f12,
+}
+
 def parse_key_name(name: str):
     name = name.strip().lower()
     if not name:
         return None
-    mapping = {
-        'enter': Key.enter, 'return': Key.enter, 'space': Key.space, 'tab': Key.tab,
-        'esc': Key.esc, 'escape': Key.esc, 'backspace': Key.backspace,
-        'shift': Key.shift, 'ctrl': Key.ctrl, 'control': Key.ctrl, 'alt': Key.alt,
-        'cmd': Key.cmd, 'super': Key.cmd, 'win': Key.cmd, 'capslock': Key.caps_lock,
-        'up': Key.up, 'down': Key.down, 'left': Key.left, 'right': Key.right,
-        'home': Key.home, 'end': Key.end, 'pageup': Key.page_up, 'pagedown': Key.page_down,
-        'insert': Key.insert, 'delete': Key.delete,
-        'f1': Key.f1, 'f2': Key.f2, 'f3': Key.f3, 'f4': Key.f4,
-        'f5': Key.f5, 'f6': Key.f6, 'f7': Key.f7, 'f8': Key.f8,
-        'f9': Key.f9, 'f10': Key.f10, 'f11': Key.f11, 'f12': Key.f12,
-    }
+    mapping = KEY_NAMES
     if name in mapping:
         return mapping[name]
     if len(name) == 1:
         return name
     return name
 
-class AutoController:
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIGNED_BUCKETS = (-1.0, -0.25, -0.1, -0.05, -0.01, -0.001, 0.0, 0.001, 0.01, 0.05, 0.1, 0.25, 1.0, 5.0)
+
+def _format_labels(labels, extra=None):
+    items = list(labels)
+    if extra: items.append(extra)
+    if not items:
+        return ''
+    return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in items) + '}'
+
+class Counter:
+    kind = 'counter'
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+    def render(self):
+        return ['%s%s %s' % (self.name, _format_labels(self.labels), self.value)]
+
+class Gauge(Counter):
+    kind = 'gauge'
+    def set(self, v):
+        self.value = v
+
+class Histogram:
+    kind = 'histogram'
+    def __init__(self, name, labels, buckets=TIME_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, v):
+        i = bisect.bisect_left(self.buckets, v)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += v
+            self.count += 1
+
+    def render(self):
+        with self._lock:
+            counts = list(self.counts); total = self.sum; n = self.count
+        lines = []
+        acc = 0
+        for le, c in zip(self.buckets, counts):
+            acc += c
+            lines.append('%s_bucket%s %d' % (self.name, _format_labels(self.labels, ('le', repr(float(le)))), acc))
+        lines.append('%s_bucket%s %d' % (self.name, _format_labels(self.labels, ('le', '+Inf')), n))
+        lines.append('%s_sum%s %r' % (self.name, _format_labels(self.labels), total))
+        lines.append('%s_count%s %d' % (self.name, _format_labels(self.labels), n))
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._help = {}
+
+    def _get(self, cls, name, help_text, labels, **kw):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            m = self._metrics.get(key)
+            if m is None:
+                m = cls(name, key[1], **kw)
+                self._metrics[key] = m
+                if help_text: self._help.setdefault(name, help_text)
+            return m
+
+    def counter(self, name, help_text='', **labels):
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text='', **labels):
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text='', buckets=TIME_BUCKETS, **labels):
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.items())
+        out = {}
+        for (name, labels), m in metrics:
+            key = name + _format_labels(labels)
+            if isinstance(m, Histogram):
+                out[key] = {'count': m.count, 'sum': m.sum}
+            else:
+                out[key] = m.value
+        return out
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.items(), key=lambda kv: kv[0])
+        out = []
+        seen = set()
+        for (name, _), m in metrics:
+            if name not in seen:
+                seen.add(name)
+                if name in self._help: out.append('# HELP %s %s' % (name, self._help[name]))
+                out.append('# TYPE %s %s' % (name, m.kind))
+            out.extend(m.render())
+        return '\n'.join(out) + '\n'
+
+METRICS = MetricsRegistry()
+_M_CYCLES = METRICS.counter('smkb_cycles_total', 'Completed automation cycles')
+_M_ACTIONS_KB = METRICS.counter('smkb_actions_total', 'Actions executed per device', device='kb')
+_M_ACTIONS_MOUSE = METRICS.counter('smkb_actions_total', 'Actions executed per device', device='mouse')
+_M_CYCLE_SECONDS = METRICS.histogram('smkb_cycle_duration_seconds', 'Wall time of one automation cycle', buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0))
+_M_CYCLE_DRIFT = METRICS.histogram('smkb_cycle_drift_seconds', 'Cycle period minus the estimated chant period', buckets=SIGNED_BUCKETS)
+_M_HOLD_ERROR = METRICS.histogram('smkb_hold_error_seconds', 'Actual minus requested hold duration', buckets=SIGNED_BUCKETS)
+_M_STEP_LATENCY = METRICS.histogram('smkb_step_boundary_latency_seconds', 'Delay between a step barrier being due and the next step being dispatched')
+_M_STOP_LATENCY = METRICS.histogram('smkb_stop_latency_seconds', 'Time from stop request to the automation thread exiting')
+_M_GC_PAUSE = METRICS.histogram('smkb_gc_pause_seconds', 'Time the interpreter spent in cyclic garbage collection')
+_M_GC_COLLECTIONS = dict((g, METRICS.counter('smkb_gc_collections_total', 'Cyclic garbage collections by generation', generation=str(g))) for g in range(3))
+_M_CYCLE_BLOCKS = METRICS.histogram('smkb_cycle_alloc_blocks', 'Net memory blocks allocated over one automation cycle', buckets=(-1000, -100, 0, 100, 1000, 10000, 100000))
+# The collector can run on a thread that is inside one of these metrics' own
+# critical sections, so the GC callback needs reentrant locks to record safely.
+for _m in (_M_GC_PAUSE,) + tuple(_M_GC_COLLECTIONS.values()):
+    _m._lock = threading.RLock()
+
+_gc_started = [0.0]
+def _gc_callback(phase, info):
+    if phase == 'start':
+        _gc_started[0] = time.perf_counter()
+        return
+    _M_GC_PAUSE.observe(time.perf_counter() - _gc_started[0])
+    c = _M_GC_COLLECTIONS.get(info.get('generation'))
+    if c is not None: c.inc()
+gc.callbacks.append(_gc_callback)
+
+def _observe_hold(elapsed, hold_ms, stop_event=None):
+    if stop_event is not None and stop_event.is_set():
+        return
+    _M_HOLD_ERROR.observe(elapsed - ms_to_sec(hold_ms))
+
+_M_RESUME_LATENCY = METRICS.histogram('smkb_resume_latency_seconds', 'Time from a resume request until the engine sends input again')
+
+class InputGate:
+    # Every backend call goes through here. Calls are serialised under one
+    # condition, so pause() sees exactly what the backend holds and nothing
+    # reaches the backend until resume(). Paused time is kept for _PausableClock.
     def __init__(self):
-        self.kc = KController()
-        self.mc = MController()
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.now = time.perf_counter
+        self.stop_event = None
+        self.reset()
+
+    def reset(self):
+        # gated: set from pause until the first input call after resume, so
+        # the backend hot path checks a single attribute.
+        self.gated = False
+        self.paused = False
+        self.paused_at = 0.0
+        self.paused_total = 0.0
+        self.saved = None
+        self.resumed_at = None
+        self.keys = set()
+        self.buttons = set()
+
+    def wait(self):
+        # Caller holds cond and has seen paused set. False means the run was
+        # stopped while paused.
+        while self.paused:
+            if self.stop_event is not None and self.stop_event.is_set():
+                return False
+            self.cond.wait(0.02)
+        return True
+
+    def admit(self):
+        # Caller holds cond and has seen gated set: waits out a pause, then
+        # times the first input call after resume against the resume request.
+        if self.paused and not self.wait():
+            return False
+        if self.resumed_at is not None:
+            _M_RESUME_LATENCY.observe(time.perf_counter() - self.resumed_at)
+            self.resumed_at = None
+        self.gated = False
+        return True
+
+class _MeteredKeyboard:
+    def __init__(self, kc, gate):
+        self._kc = kc
+        self._gate = gate
+        self._m_press = METRICS.counter('smkb_backend_calls_total', 'Calls into the input backend', device='kb', op='press')
+        self._m_release = METRICS.counter('smkb_backend_calls_total', 'Calls into the input backend', device='kb', op='release')
+
+    def press(self, k):
+        with self._gate.lock:
+            if self._gate.gated and not self._gate.admit(): return
+            self._m_press.inc()
+            self._kc.press(k)
+            self._gate.keys.add(k)
+
+    def release(self, k):
+        with self._gate.lock:
+            if self._gate.gated: self._gate.admit()
+            self._m_release.inc()
+            self._kc.release(k)
+            self._gate.keys.discard(k)
+
+class _MeteredMouse:
+    def __init__(self, mc, gate):
+        self._mc = mc
+        self._gate = gate
+        self._m_press = METRICS.counter('smkb_backend_calls_total', 'Calls into the input backend', device='mouse', op='press')
+        self._m_release = METRICS.counter('smkb_backend_calls_total', 'Calls into the input backend', device='mouse', op='release')
+        self._m_click = METRICS.counter('smkb_backend_calls_total', 'Calls into the input backend', device='mouse', op='click')
+        self._m_get = METRICS.counter('smkb_backend_calls_total', 'Calls into the input backend', device='mouse', op='position_get')
+        self._m_set = METRICS.counter('smkb_backend_calls_total', 'Calls into the input backend', device='mouse', op='position_set')
+
+    @property
+    def position(self):
+        with self._gate.lock:
+            if self._gate.paused: self._gate.wait()
+            self._m_get.inc()
+            return self._mc.position
+
+    @position.setter
+    def position(self, pos):
+        with self._gate.lock:
+            if self._gate.gated and not self._gate.admit(): return
+            self._m_set.inc()
+            self._mc.position = pos
+
+    def press(self, btn):
+        with self._gate.lock:
+            if self._gate.gated and not self._gate.admit(): return
+            self._m_press.inc()
+            self._mc.press(btn)
+            self._gate.buttons.add(btn)
+
+    def release(self, btn):
+        with self._gate.lock:
+            if self._gate.gated: self._gate.admit()
+            self._m_release.inc()
+            self._mc.release(btn)
+            self._gate.buttons.discard(btn)
+
+    def click(self, btn, count=1):
+        with self._gate.lock:
+            if self._gate.gated and not self._gate.admit(): return
+            self._m_click.inc()
+            self._mc.click(btn, count)
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = METRICS.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_metrics_server(port):
+    srv = http.server.ThreadingHTTPServer(('127.0.0.1', port), _MetricsHandler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+def write_metrics_file(path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(METRICS.render())
+    os.replace(tmp, path)
+
+def start_metrics_file_writer(path, interval_s=10.0):
+    stop = threading.Event()
+    def loop():
+        while True:
+            try: write_metrics_file(path)
+            except Exception as e: print('Metrics file write error:', e)
+            if stop.wait(max(0.5, interval_s)): break
+    threading.Thread(target=loop, daemon=True).start()
+    return stop
+
+def parse_cpu_list(text):
+    # Used as an argparse type, so bad input becomes a usage error.
+    cpus = set()
+    try:
+        for part in text.split(','):
+            part = part.strip()
+            if not part: continue
+            lo, sep, hi = part.partition('-')
+            if sep:
+                lo, hi = int(lo), int(hi)
+                if lo < 0 or hi < lo: raise ValueError
+                cpus.update(range(lo, hi + 1))
+            else:
+                if int(part) < 0: raise ValueError
+                cpus.add(int(part))
+    except ValueError:
+        cpus = None
+    if not cpus:
+        raise argparse.ArgumentTypeError('invalid CPU list %r (expected e.g. 3, 2,3 or 2-3)' % text)
+    return sorted(cpus)
+
+def apply_realtime(rt_priority=None, cpus=None, nice=-10):
+    # Linux applies both calls to the calling thread only, and threads it
+    # starts afterwards inherit them, so the GUI/daemon threads keep running normally.
+    applied = {'policy': None, 'priority': None, 'cpus': None, 'errors': []}
+    if cpus:
+        if hasattr(os, 'sched_setaffinity'):
+            try:
+                os.sched_setaffinity(0, cpus)
+                applied['cpus'] = sorted(os.sched_getaffinity(0))
+            except (OSError, ValueError) as e:
+                applied['errors'].append('cpu affinity %s: %s' % (','.join(map(str, cpus)), e))
+        else:
+            applied['errors'].append('cpu affinity is not supported on this platform')
+    if rt_priority:
+        if hasattr(os, 'sched_setscheduler'):
+            try:
+                prio = clamp(int(rt_priority), os.sched_get_priority_min(os.SCHED_FIFO), os.sched_get_priority_max(os.SCHED_FIFO))
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(prio))
+                applied['policy'] = 'fifo'
+                applied['priority'] = prio
+            except OSError as e:
+                applied['errors'].append('SCHED_FIFO %d: %s' % (rt_priority, e))
+        if applied['policy'] is None and hasattr(os, 'setpriority'):
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+                applied['policy'] = 'nice'
+                applied['priority'] = nice
+            except OSError as e:
+                applied['errors'].append('nice %d: %s' % (nice, e))
+        if applied['policy'] is None:
+            applied['errors'].append('running with the default scheduler')
+    return applied
+
+class AutoController:
+    def __init__(self, kc=None, mc=None):
+        self._batch = getattr(getattr(kc, 'backend', None), 'batch', None)
+        self.gate = InputGate()
+        self.kc = _MeteredKeyboard(kc or KController(), self.gate)
+        self.mc = _MeteredMouse(mc or MController(), self.gate)
         self.running = False
         self._thread = None
         self._stop_event = threading.Event()
+        self.gate.stop_event = self._stop_event
+        self.realtime = None
+        self.realtime_status = None
+        self._realtime_reported = False
 
     def start(self, job_fn):
         if self.running:
             return
         self._stop_event.clear()
+        with self.gate.cond:
+            self.gate.reset()
         self._thread = threading.Thread(target=self._run_loop, args=(job_fn,), daemon=True)
         self.running = True
         self._thread.start()
 
     def _run_loop(self, job_fn):
+        if self.realtime:
+            self.realtime_status = apply_realtime(**self.realtime)
+            if not self._realtime_reported:
+                self._realtime_reported = True
+                for err in self.realtime_status['errors']:
+                    print('Realtime scheduling:', err)
         try:
             job_fn(stop_event=self._stop_event)
         except Exception as e:
@@ -69,60 +445,636 @@ class AutoController:
         finally:
             self.running = False
 
+    def pause(self):
+        # Lift everything the backend holds, remembering it and the cursor.
+        g = self.gate
+        with g.cond:
+            if g.paused or not self.running:
+                return False
+            try: pos = self.mc._mc.position
+            except Exception: pos = None
+            g.saved = (list(g.keys), list(g.buttons), pos)
+            g.paused = g.gated = True
+            g.resumed_at = None
+            g.paused_at = g.now()
+            with self.batch():
+                for b in g.buttons:
+                    try: self.mc._mc.release(b)
+                    except Exception: pass
+                for k in g.keys:
+                    try: self.kc._kc.release(k)
+                    except Exception: pass
+        return True
+
+    def resume(self, requested_at=None):
+        g = self.gate
+        with g.cond:
+            if not g.paused:
+                return False
+            t0 = time.perf_counter() if requested_at is None else requested_at
+            keys, buttons, pos = g.saved
+            with self.batch():
+                if pos is not None:
+                    try: self.mc._mc.position = pos
+                    except Exception: pass
+                # Modifiers first, so a held ctrl+x comes back as ctrl+x.
+                for k in sorted(keys, key=lambda k: isinstance(k, str)):
+                    try: self.kc._kc.press(k)
+                    except Exception: pass
+                for b in buttons:
+                    try: self.mc._mc.press(b)
+                    except Exception: pass
+            g.paused_total += g.now() - g.paused_at
+            g.saved = None
+            g.paused = False
+            g.resumed_at = t0
+            g.cond.notify_all()
+        return True
+
+    def batch(self):
+        # Backends that buffer events (XTest) flush once when the outermost batch ends.
+        return self._batch() if self._batch else contextlib.nullcontext()
+
     def stop(self):
         if not self.running:
             return
+        t0 = time.perf_counter()
         self._stop_event.set()
+        with self.gate.cond:
+            self.gate.cond.notify_all()
         if self._thread:
             self._thread.join(timeout=1)
+            if not self._thread.is_alive():
+                _M_STOP_LATENCY.observe(time.perf_counter() - t0)
         self.running = False
 
+XTEST_KEYSYMS = {
+    'enter': 'Return', 'space': 'space', 'tab': 'Tab', 'esc': 'Escape', 'backspace': 'BackSpace',
+    'shift': 'Shift_L', 'shift_l': 'Shift_L', 'shift_r': 'Shift_R',
+    'ctrl': 'Control_L', 'ctrl_l': 'Control_L', 'ctrl_r': 'Control_R',
+    'alt': 'Alt_L', 'alt_l': 'Alt_L', 'alt_r': 'Alt_R', 'alt_gr': 'ISO_Level3_Shift',
+    'cmd': 'Super_L', 'cmd_l': 'Super_L', 'cmd_r': 'Super_R',
+    'caps_lock': 'Caps_Lock', 'num_lock': 'Num_Lock', 'scroll_lock': 'Scroll_Lock',
+    'print_screen': 'Print', 'pause': 'Pause', 'menu': 'Menu',
+    'up': 'Up', 'down': 'Down', 'left': 'Left', 'right': 'Right', 'home': 'Home', 'end': 'End',
+    'page_up': 'Prior', 'page_down': 'Next', 'insert': 'Insert', 'delete': 'Delete',
+}
+XTEST_BUTTONS = {'left': 1, 'middle': 2, 'right': 3}
+
+def _char_keysym(ch):
+    o = ord(ch)
+    if 0x20 <= o <= 0x7e or 0xa0 <= o <= 0xff:
+        return o
+    return 0x01000000 | o
+
+class _XErrorEvent(ctypes.Structure):
+    _fields_ = [('type', ctypes.c_int), ('display', ctypes.c_void_p), ('resourceid', ctypes.c_ulong), ('serial', ctypes.c_ulong),
+                ('error_code', ctypes.c_ubyte), ('request_code', ctypes.c_ubyte), ('minor_code', ctypes.c_ubyte)]
+
+_M_X_ERRORS = METRICS.counter('smkb_x_errors_total', 'X protocol errors reported to the XTest backend')
+
+def _on_x_error(dpy, event):
+    # Xlib's default handler exits the process on any protocol error (a
+    # keycode the server rejects, say); count it and keep running instead.
+    e = event.contents
+    _M_X_ERRORS.inc()
+    print('X error %d on request %d.%d' % (e.error_code, e.request_code, e.minor_code))
+    return 0
+
+_X_ERROR_HANDLER = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(_XErrorEvent))(_on_x_error)
+
+class XTestBackend:
+    # Talks to libXtst directly: one display connection shared by every thread
+    # (XInitThreads plus our own lock), events are buffered and flushed once
+    # per call or once per batch().
+    def __init__(self, display=None):
+        x11_path = ctypes.util.find_library('X11')
+        xtst_path = ctypes.util.find_library('Xtst')
+        if not x11_path or not xtst_path:
+            raise OSError('libX11/libXtst not found')
+        x11 = ctypes.CDLL(x11_path)
+        xtst = ctypes.CDLL(xtst_path)
+        dpy, ulong, uint, cint = ctypes.c_void_p, ctypes.c_ulong, ctypes.c_uint, ctypes.c_int
+        pint = ctypes.POINTER(cint)
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]; x11.XOpenDisplay.restype = dpy
+        x11.XCloseDisplay.argtypes = [dpy]
+        x11.XFlush.argtypes = [dpy]
+        x11.XSync.argtypes = [dpy, cint]
+        x11.XDefaultRootWindow.argtypes = [dpy]; x11.XDefaultRootWindow.restype = ulong
+        x11.XStringToKeysym.argtypes = [ctypes.c_char_p]; x11.XStringToKeysym.restype = ulong
+        x11.XKeysymToKeycode.argtypes = [dpy, ulong]; x11.XKeysymToKeycode.restype = ctypes.c_ubyte
+        x11.XkbKeycodeToKeysym.argtypes = [dpy, ctypes.c_ubyte, cint, cint]; x11.XkbKeycodeToKeysym.restype = ulong
+        x11.XQueryPointer.argtypes = [dpy, ulong, ctypes.POINTER(ulong), ctypes.POINTER(ulong), pint, pint, pint, pint, ctypes.POINTER(uint)]
+        xtst.XTestQueryExtension.argtypes = [dpy, pint, pint, pint, pint]
+        xtst.XTestFakeKeyEvent.argtypes = [dpy, uint, cint, ulong]
+        xtst.XTestFakeButtonEvent.argtypes = [dpy, uint, cint, ulong]
+        xtst.XTestFakeMotionEvent.argtypes = [dpy, cint, cint, cint, ulong]
+        x11.XSetErrorHandler.argtypes = [type(_X_ERROR_HANDLER)]; x11.XSetErrorHandler.restype = ctypes.c_void_p
+        x11.XInitThreads()
+        x11.XSetErrorHandler(_X_ERROR_HANDLER)
+        self.dpy = x11.XOpenDisplay(display.encode() if display else None)
+        if not self.dpy:
+            raise OSError('cannot open X display %s' % (display or os.environ.get('DISPLAY') or '(DISPLAY unset)'))
+        n = cint()
+        if not xtst.XTestQueryExtension(self.dpy, ctypes.byref(n), ctypes.byref(n), ctypes.byref(n), ctypes.byref(n)):
+            x11.XCloseDisplay(self.dpy)
+            raise OSError('X server has no XTEST extension')
+        self.x11 = x11
+        self.xtst = xtst
+        self.root = x11.XDefaultRootWindow(self.dpy)
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._keycodes = {}
+        self.shift_code = x11.XKeysymToKeycode(self.dpy, x11.XStringToKeysym(b'Shift_L'))
+        self.shift_codes = {self.shift_code, x11.XKeysymToKeycode(self.dpy, x11.XStringToKeysym(b'Shift_R'))} - {0}
+        self.keyboard = XTestKeyboard(self)
+        self.mouse = XTestMouse(self)
+
+    @contextlib.contextmanager
+    def batch(self):
+        with self._lock:
+            self._depth += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.x11.XFlush(self.dpy)
+
+    def fake_key(self, keycode, down):
+        with self._lock:
+            self.xtst.XTestFakeKeyEvent(self.dpy, keycode, int(down), 0)
+            if self._depth == 0: self.x11.XFlush(self.dpy)
+
+    def fake_button(self, button, down):
+        with self._lock:
+            self.xtst.XTestFakeButtonEvent(self.dpy, button, int(down), 0)
+            if self._depth == 0: self.x11.XFlush(self.dpy)
+
+    def fake_motion(self, x, y):
+        with self._lock:
+            self.xtst.XTestFakeMotionEvent(self.dpy, -1, x, y, 0)
+            if self._depth == 0: self.x11.XFlush(self.dpy)
+
+    def pointer(self):
+        root, child = ctypes.c_ulong(), ctypes.c_ulong()
+        rx, ry, wx, wy = ctypes.c_int(), ctypes.c_int(), ctypes.c_int(), ctypes.c_int()
+        mask = ctypes.c_uint()
+        with self._lock:
+            self.x11.XQueryPointer(self.dpy, self.root, ctypes.byref(root), ctypes.byref(child),
+                                   ctypes.byref(rx), ctypes.byref(ry), ctypes.byref(wx), ctypes.byref(wy), ctypes.byref(mask))
+        return (rx.value, ry.value)
+
+    def sync(self):
+        with self._lock:
+            self.x11.XSync(self.dpy, 0)
+
+    def close(self):
+        with self._lock:
+            if self.dpy:
+                self.x11.XCloseDisplay(self.dpy)
+                self.dpy = None
+
+    def _keysym(self, key):
+        if isinstance(key, str):
+            if len(key) == 1:
+                return _char_keysym(key)
+            return self.x11.XStringToKeysym(key.encode()) or None
+        name = getattr(key, 'name', None)
+        if name:
+            sym = XTEST_KEYSYMS.get(name)
+            if sym is None and name[:1] == 'f' and name[1:].isdigit():
+                sym = 'F' + name[1:]
+            if sym is None:
+                return None
+            return self.x11.XStringToKeysym(sym.encode()) or None
+        char = getattr(key, 'char', None)
+        if char:
+            return _char_keysym(char)
+        return getattr(key, 'vk', None)
+
+    def keycode(self, key):
+        # (keycode, needs_shift), or None when the active layout has no key for it.
+        try:
+            return self._keycodes[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return None
+        code = None
+        keysym = self._keysym(key)
+        if keysym:
+            with self._lock:
+                kc = self.x11.XKeysymToKeycode(self.dpy, keysym)
+                if kc:
+                    if self.x11.XkbKeycodeToKeysym(self.dpy, kc, 0, 0) == keysym:
+                        code = (kc, False)
+                    elif self.x11.XkbKeycodeToKeysym(self.dpy, kc, 0, 1) == keysym:
+                        code = (kc, True)
+        self._keycodes[key] = code
+        return code
+
+class XTestKeyboard:
+    def __init__(self, backend):
+        self.backend = backend
+        self._fallback = None
+        self._down = set()
+
+    def _fallback_kc(self):
+        # Keys the layout cannot produce directly (AltGr levels, unmapped
+        # Unicode) go through pynput, which remaps a spare keycode for them.
+        if self._fallback is None:
+            self._fallback = KController()
+        return self._fallback
+
+    def press(self, key):
+        code = self.backend.keycode(key)
+        if code is None:
+            return self._fallback_kc().press(key)
+        kc, shift = code
+        # A Shift the chant is already holding is left alone, as pynput does.
+        shift = shift and not self._down & self.backend.shift_codes
+        with self.backend.batch():
+            if shift: self.backend.fake_key(self.backend.shift_code, True)
+            self.backend.fake_key(kc, True)
+        if not code[1]: self._down.add(kc)
+
+    def release(self, key):
+        code = self.backend.keycode(key)
+        if code is None:
+            return self._fallback_kc().release(key)
+        kc, shift = code
+        if not shift: self._down.discard(kc)
+        shift = shift and not self._down & self.backend.shift_codes
+        with self.backend.batch():
+            self.backend.fake_key(kc, False)
+            if shift: self.backend.fake_key(self.backend.shift_code, False)
+
+class XTestMouse:
+    def __init__(self, backend):
+        self.backend = backend
+
+    @property
+    def position(self):
+        return self.backend.pointer()
+
+    @position.setter
+    def position(self, pos):
+        self.backend.fake_motion(int(pos[0]), int(pos[1]))
+
+    @staticmethod
+    def _button(button):
+        if isinstance(button, int):
+            return button
+        return XTEST_BUTTONS[getattr(button, 'name', button)]
+
+    def press(self, button):
+        self.backend.fake_button(self._button(button), True)
+
+    def release(self, button):
+        self.backend.fake_button(self._button(button), False)
+
+    def click(self, button, count=1):
+        b = self._button(button)
+        with self.backend.batch():
+            for _ in range(count):
+                self.backend.fake_button(b, True)
+                self.backend.fake_button(b, False)
+
+def make_controller(backend='pynput', display=None):
+    if backend == 'xtest':
+        try:
+            xt = XTestBackend(display)
+        except (OSError, AttributeError) as e:
+            print('XTest backend unavailable (%s); using pynput' % e)
+        else:
+            return AutoController(xt.keyboard, xt.mouse)
+    return AutoController()
+
+class _PausableClock:
+    # Wraps the engine clock so every sleep stops at the gate while paused and
+    # now() leaves paused time out: holds, offsets, rate deadlines and cycle
+    # timing all carry on from where they were.
+    def __init__(self, clock, gate):
+        self.inner = clock
+        self.gate = gate
+        self.spin_s = clock.spin_s
+        gate.now = clock.now
+
+    def now(self):
+        g = self.gate
+        if g.paused:
+            return g.paused_at - g.paused_total
+        return self.inner.now() - g.paused_total
+
+    def sleep(self, dt):
+        self.inner.sleep(dt)
+        if self.gate.paused:
+            with self.gate.cond:
+                self.gate.wait()
+
+    def spawn(self, target, args=()):
+        return self.inner.spawn(target, args)
+
+    def join(self, t, stop_event=None):
+        return self.inner.join(t, stop_event)
+
+class RealClock:
+    spin_s = 0.0015
+    now = staticmethod(time.perf_counter)
+    sleep = staticmethod(time.sleep)
+
+    def spawn(self, target, args=()):
+        t = threading.Thread(target=target, args=args, daemon=True)
+        t.start()
+        return t
+
+    def join(self, t, stop_event=None):
+        while t.is_alive():
+            if stop_event is not None and stop_event.is_set(): return
+            t.join(timeout=0.05)
+
+class _SimTask:
+    __slots__ = ('alive', 'joiners')
+    def __init__(self):
+        self.alive = True
+        self.joiners = []
+
+    def is_alive(self):
+        return self.alive
+
+class VirtualClock:
+    spin_s = 0.0
+
+    def __init__(self):
+        self._now = 0.0
+        self._cv = threading.Condition()
+        self._queue = []
+        self._seq = 0
+        self._current = None
+        self._local = threading.local()
+        self._stop_event = None
+        self._until = None
+        self.errors = []
+
+    def now(self):
+        return self._now
+
+    def _schedule(self, task, wake):
+        self._seq += 1
+        heapq.heappush(self._queue, (wake, self._seq, task))
+
+    def _switch(self):
+        if self._queue:
+            wake, _, task = heapq.heappop(self._queue)
+            if self._until is not None and wake > self._until:
+                if self._stop_event is not None: self._stop_event.set()
+                wake = max(self._now, self._until)
+            self._now = max(self._now, wake)
+            self._current = task
+        else:
+            self._current = None
+        self._cv.notify_all()
+
+    def _wait_turn(self, task):
+        while self._current is not task:
+            self._cv.wait()
+
+    def spawn(self, target, args=()):
+        task = _SimTask()
+        def body():
+            self._local.task = task
+            with self._cv:
+                self._wait_turn(task)
+            try:
+                target(*args)
+            except Exception as e:
+                self.errors.append(e)
+                print('Simulated thread error:', e)
+            finally:
+                with self._cv:
+                    task.alive = False
+                    for j in task.joiners:
+                        self._schedule(j, self._now)
+                    task.joiners = []
+                    self._switch()
+        with self._cv:
+            self._schedule(task, self._now)
+        threading.Thread(target=body, daemon=True).start()
+        return task
+
+    def sleep(self, dt):
+        task = self._local.task
+        with self._cv:
+            self._schedule(task, self._now + max(0.0, dt))
+            self._switch()
+            self._wait_turn(task)
+
+    def join(self, task, stop_event=None):
+        me = self._local.task
+        with self._cv:
+            if not task.alive:
+                return
+            task.joiners.append(me)
+            self._switch()
+            self._wait_turn(me)
+
+    def run(self, target, args=(), stop_event=None, until=None):
+        self._stop_event = stop_event
+        self._until = until
+        root = self.spawn(target, args)
+        with self._cv:
+            self._switch()
+            while self._current is not None:
+                self._cv.wait()
+        return not root.alive
+
+def _input_name(x):
+    return x.name if hasattr(x, 'name') else x
+
+class SimKeyboard:
+    def __init__(self, clock, events):
+        self.clock = clock
+        self.events = events
+
+    def press(self, k):
+        self.events.append((self.clock.now(), 'kb', 'press', _input_name(k)))
+
+    def release(self, k):
+        self.events.append((self.clock.now(), 'kb', 'release', _input_name(k)))
+
+class SimMouse:
+    def __init__(self, clock, events, position=(0, 0)):
+        self.clock = clock
+        self.events = events
+        self._position = (int(position[0]), int(position[1]))
+
+    @property
+    def position(self):
+        return self._position
+
+    @position.setter
+    def position(self, pos):
+        self._position = (int(pos[0]), int(pos[1]))
+        self.events.append((self.clock.now(), 'mouse', 'move', self._position))
+
+    def press(self, btn):
+        self.events.append((self.clock.now(), 'mouse', 'press', _input_name(btn)))
+
+    def release(self, btn):
+        self.events.append((self.clock.now(), 'mouse', 'release', _input_name(btn)))
+
+    def click(self, btn, count=1):
+        self.events.append((self.clock.now(), 'mouse', 'click', _input_name(btn)))
+
+class _BoundRandom:
+    def __init__(self, high):
+        self.high = high
+
+    def randint(self, a, b):
+        return max(a, b) if self.high else min(a, b)
+
+    def uniform(self, a, b):
+        return max(a, b) if self.high else min(a, b)
+
+    def choice(self, seq):
+        return seq[-1] if self.high else seq[0]
+
 MODIFIER_RE = re.compile(r"(\w+)=([-\w.,]+)")
+OFFSET_RE = re.compile(r"@\+?(\d+)$")
+TYPE_RE = re.compile(r'type\s*=\s*"((?:[^"\\]|\\.)*)"$', re.S)
+_ESCAPE_RE = re.compile(r'\\(.)', re.S)
+_ESCAPES = {'n': '\n', 't': '\t'}
+TEXT_KEYS = {'\n': Key.enter, '\t': Key.tab, ' ': Key.space}
+
+_TYPE_OPEN_RE = re.compile(r'(?<!\w)type\s*=\s*"', re.I)
+
+def _find_unquoted(text, sep, pos=0):
+    # Only the quotes of a type="..." token hide separators; any other " is
+    # an ordinary key.
+    j = text.find(sep, pos)
+    m = _TYPE_OPEN_RE.search(text, pos)
+    n = len(text)
+    while m and j >= 0 and m.end() - 1 < j:
+        i = m.end()
+        while i < n and text[i] != '"':
+            i += 2 if text[i] == '\\' else 1
+        if i >= n:
+            return -1
+        j = text.find(sep, i + 1)
+        m = _TYPE_OPEN_RE.search(text, i + 1)
+    return j
+
+def _split_unquoted(text, sep):
+    if '"' not in text:
+        return text.split(sep)
+    out = []
+    pos = 0
+    while True:
+        j = _find_unquoted(text, sep, pos)
+        if j < 0:
+            out.append(text[pos:])
+            return out
+        out.append(text[pos:j])
+        pos = j + len(sep)
+
+def resolve_text(text):
+    out = []
+    for ch in text:
+        if ch in TEXT_KEYS:
+            out.append((TEXT_KEYS[ch], False))
+        elif 'A' <= ch <= 'Z':
+            out.append((ch.lower(), True))
+        else:
+            out.append((ch, False))
+    return tuple(out)
+
+def _parse_type_action(it, modifiers):
+    mt = TYPE_RE.match(it[0])
+    if not mt:
+        return None
+    text = _ESCAPE_RE.sub(lambda m: _ESCAPES.get(m.group(1), m.group(1)), mt.group(1))
+    cps = 30.0; human = 0; repeat = 1; offset = 0; lane = None
+    for m in modifiers:
+        mo = OFFSET_RE.match(m)
+        if mo:
+            offset = int(mo.group(1)); continue
+        mm = MODIFIER_RE.match(m)
+        if not mm: continue
+        k, v = mm.group(1).lower(), mm.group(2)
+        if k == 'cps':
+            try: cps = max(0.1, float(v))
+            except: pass
+        elif k == 'human':
+            try: human = clamp(int(v), 0, 90)
+            except: pass
+        elif k == 'repeat':
+            try: repeat = max(1, int(v))
+            except: pass
+        elif k == 'lane':
+            lane = v.lower()
+    return {'keys': [], 'simul': False, 'hold': None, 'repeat': repeat, 'offset': offset, 'lane': lane,
+            'type': text, 'chars': resolve_text(text), 'cps': cps, 'human': human, 'raw': it[1]}
 
 def parse_sequence(raw: str):
     actions = []
     if not raw:
         return actions
-    items = [s.strip() for s in raw.split(',') if s.strip()]
+    items = [s.strip() for s in _split_unquoted(raw, ',') if s.strip()]
     for it in items:
-        parts = [p.strip() for p in it.split('|') if p.strip()]
+        parts = [p.strip() for p in _split_unquoted(it, '|') if p.strip()]
         if not parts: continue
         key_part = parts[0]
         modifiers = parts[1:]
+        if key_part[:4].lower() == 'type':
+            tact = _parse_type_action((key_part, it), modifiers)
+            if tact is not None:
+                actions.append(tact)
+                continue
         key_names = [k.strip() for k in key_part.split('+') if k.strip()]
         parsed_keys = [parse_key_name(k) for k in key_names]
         simul = len(parsed_keys) > 1
-        hold = None; repeat = 1
+        hold = None; repeat = 1; offset = 0; lane = None
         for m in modifiers:
+            mo = OFFSET_RE.match(m)
+            if mo:
+                offset = int(mo.group(1)); continue
             mm = MODIFIER_RE.match(m)
             if not mm: continue
             k, v = mm.group(1).lower(), mm.group(2)
             if k == 'hold':
-                try: hold = int(v)
+                try: hold = int(v) if int(v) >= 0 else hold
                 except: hold = None
             elif k == 'repeat':
                 try: repeat = max(1, int(v))
                 except: repeat = 1
-        actions.append({'keys': parsed_keys, 'simul': simul, 'hold': hold, 'repeat': repeat, 'raw': it})
+            elif k == 'lane':
+                lane = v.lower()
+        actions.append({'keys': parsed_keys, 'simul': simul, 'hold': hold, 'repeat': repeat, 'offset': offset, 'lane': lane, 'raw': it})
     return actions
 
 def parse_chant(raw: str):
     steps = []
     if not raw:
         return steps
-    raw_steps = [s.strip() for s in raw.split(';') if s.strip()]
+    raw_steps = [s.strip() for s in _split_unquoted(raw, ';') if s.strip()]
     for st in raw_steps:
-        parts = [p.strip() for p in st.split('||') if p.strip()]
+        parts = [p.strip() for p in _split_unquoted(st, '||') if p.strip()]
         step_actions = []
         for p in parts:
             low = p.lower().strip()
             if low == 'stop':
                 step_actions.append({'device':'stop', 'raw':p})
                 continue
+            if low == 'sync' or low.startswith('sync='):
+                lanes = [n.strip() for n in low[5:].split(',') if n.strip()]
+                step_actions.append({'device':'sync', 'lanes':lanes or None, 'raw':p})
+                continue
             if p.lower().startswith('mouse') or p.lower().startswith('m(') or p.lower().startswith('m '):
                 tok_parts = [q.strip() for q in p.split('|') if q.strip()]
                 pos = None
-                move = None; hold = None; button = 'left'; rel = None; dist = None; repeat = 1
+                move = None; hold = None; button = 'left'; rel = None; dist = None; repeat = 1; offset = 0; lane = None
                 first = tok_parts[0]
                 mcoords = re.match(r'm(?:ouse)?\s*\(\s*([-\d]+)\s*,\s*([-\d]+)\s*\)', first, re.I)
                 if mcoords:
@@ -131,14 +1083,17 @@ def parse_chant(raw: str):
                     except:
                         pos = None
                 for mod in tok_parts[1:]:
+                    mo = OFFSET_RE.match(mod)
+                    if mo:
+                        offset = int(mo.group(1)); continue
                     mm = MODIFIER_RE.match(mod)
                     if not mm: continue
                     k, v = mm.group(1).lower(), mm.group(2)
                     if k == 'move':
-                        try: move = int(v)
+                        try: move = int(v) if int(v) >= 0 else move
                         except: pass
                     elif k == 'hold':
-                        try: hold = int(v)
+                        try: hold = int(v) if int(v) >= 0 else hold
                         except: pass
                     elif k == 'button':
                         if v.lower() in ('left','right'):
@@ -147,12 +1102,14 @@ def parse_chant(raw: str):
                         try: rel = float(v)
                         except: pass
                     elif k == 'dist':
-                        try: dist = int(v)
+                        try: dist = int(v) if int(v) >= 0 else dist
                         except: pass
                     elif k == 'repeat':
                         try: repeat = max(1, int(v))
                         except: pass
-                step_actions.append({'device':'mouse', 'pos':pos, 'move':move, 'hold':hold, 'button':button, 'rel':rel, 'dist':dist, 'repeat':repeat, 'raw':p})
+                    elif k == 'lane':
+                        lane = v.lower()
+                step_actions.append({'device':'mouse', 'pos':pos, 'move':move, 'hold':hold, 'button':button, 'rel':rel, 'dist':dist, 'repeat':repeat, 'offset':offset, 'lane':lane, 'raw':p})
             else:
                 kb_parsed = parse_sequence(p)
                 if not kb_parsed:
@@ -165,6 +1122,433 @@ def parse_chant(raw: str):
             steps.append(step_actions)
     return steps
 
+def estimate_action_ms(act, default_move_dur=200):
+    repeat = act.get('repeat', 1) or 1
+    hold = act.get('hold') or 0
+    if act.get('device') == 'mouse':
+        move_ms = act.get('move') or default_move_dur
+        moving = act.get('pos') is not None or act.get('rel') is not None
+        if hold:
+            per = max(min(150, move_ms) + hold, move_ms if moving else 0)
+        else:
+            per = move_ms if moving else 0
+        return per * repeat
+    if act.get('device') == 'kb':
+        if act.get('type') is not None:
+            # The first character goes out at once, so n characters span n-1 intervals.
+            return max(0, len(act['chars']) - 1) * 1000.0 / act.get('cps', 30.0) * repeat
+        keys = [k for k in act.get('keys', []) if k is not None]
+        per = (hold or 10) if act.get('simul') else len(keys) * (hold or 10)
+        return per * repeat
+    return 0
+
+def _chant_timeline(steps, default_move_dur=200, global_ms=0):
+    # Yields (start, end, lane_end) per step up to the first stop. end is when
+    # the step's own actions and syncs finish; lane_end maps each lane to when
+    # its queued work finishes, so it can run past end.
+    t = 0
+    lane_end = {}
+    for step in steps:
+        if any(act.get('device') == 'stop' for act in step):
+            return
+        end = t
+        for act in step:
+            if act.get('device') == 'sync':
+                continue
+            start = t + (act.get('offset') or 0)
+            dur = estimate_action_ms(act, default_move_dur)
+            lane = act.get('lane')
+            if lane:
+                start = max(start, lane_end.get(lane, 0))
+                lane_end[lane] = start + dur
+            else:
+                end = max(end, start + dur)
+        for act in step:
+            if act.get('device') == 'sync':
+                names = act.get('lanes') or list(lane_end)
+                end = max([end] + [lane_end.get(n, 0) for n in names])
+        yield t, end, lane_end
+        t = end + global_ms
+
+def estimate_chant_ms(steps, default_move_dur=200, global_ms=0):
+    t = 0
+    lane_end = {}
+    for _, end, lane_end in _chant_timeline(steps, default_move_dur, global_ms):
+        t = end + global_ms
+    return max([t] + list(lane_end.values()))
+
+def estimate_step_ms(steps, default_move_dur=200, global_ms=0):
+    # Time from each step's start until it and every lane still running have
+    # finished, i.e. how long an instance expects to hold the input slot.
+    return [max([end] + list(lane_end.values())) - start
+            for start, end, lane_end in _chant_timeline(steps, default_move_dur, global_ms)]
+
+def estimate_action_calls(act, default_move_dur=200):
+    repeat = act.get('repeat', 1) or 1
+    if act.get('device') == 'mouse':
+        move_ms = act.get('move') or default_move_dur
+        per = 0
+        if act.get('rel') is not None:
+            per += 1
+        if act.get('pos') is not None or act.get('rel') is not None:
+            per += max(1, int(max(1, move_ms) / 8)) + 2
+        if act.get('hold'):
+            per += 2
+        else:
+            per += 2 if act.get('pos') is not None or act.get('rel') is not None else 1
+        return per * repeat
+    if act.get('device') == 'kb':
+        if act.get('type') is not None:
+            return 2 * (len(act['chars']) + sum(1 for _, shifted in act['chars'] if shifted)) * repeat
+        return 2 * len([k for k in act.get('keys', []) if k is not None]) * repeat
+    return 0
+
+MOUSE_MODIFIERS = {'move': int, 'hold': int, 'button': ('left', 'right'), 'rel': float, 'dist': int, 'repeat': int, 'lane': str}
+KB_MODIFIERS = {'hold': int, 'repeat': int, 'lane': str}
+TYPE_MODIFIERS = {'cps': float, 'human': int, 'repeat': int, 'lane': str}
+MOUSE_TARGET_RE = re.compile(r'm(?:ouse)?\s*(?:\(\s*([-\d]+)\s*,\s*([-\d]+)\s*\))?$', re.I)
+
+def _split_spans(text, sep, base=0):
+    out = []
+    pos = 0
+    quoted = '"' in text
+    while True:
+        j = _find_unquoted(text, sep, pos) if quoted else text.find(sep, pos)
+        end = len(text) if j < 0 else j
+        seg = text[pos:end]
+        stripped = seg.strip()
+        if stripped:
+            start = base + pos + len(seg) - len(seg.lstrip())
+            out.append((start, start + len(stripped), stripped))
+        if j < 0:
+            return out
+        pos = j + len(sep)
+
+def _lint_modifiers(mods, known, diags):
+    for start, end, mod in mods:
+        if mod.startswith('@'):
+            if not OFFSET_RE.match(mod):
+                diags.append((start, end, 'error', "invalid start offset '%s' (expected @+ms)" % mod))
+            continue
+        mm = MODIFIER_RE.fullmatch(mod)
+        if not mm:
+            diags.append((start, end, 'error', "malformed modifier '%s' (expected name=value)" % mod))
+            continue
+        k, v = mm.group(1).lower(), mm.group(2)
+        kind = known.get(k)
+        if kind is None:
+            diags.append((start, start + len(mm.group(1)), 'error', "unknown modifier '%s'" % mm.group(1)))
+            continue
+        vstart = start + mm.start(2)
+        if kind is str:
+            continue
+        if isinstance(kind, tuple):
+            if v.lower() not in kind:
+                diags.append((vstart, end, 'error', "invalid %s '%s' (expected %s)" % (k, v, '/'.join(kind))))
+            continue
+        try:
+            num = kind(v)
+        except ValueError:
+            diags.append((vstart, end, 'error', "invalid %s '%s' (expected %s)" % (k, v, 'integer' if kind is int else 'number')))
+            continue
+        if k == 'repeat' and num < 1:
+            diags.append((vstart, end, 'warning', 'repeat below 1 is treated as 1'))
+        elif k in ('hold', 'move', 'dist') and num < 0:
+            diags.append((vstart, end, 'warning', 'negative %s is ignored' % k))
+
+def lint_part(part, base=0):
+    diags = []
+    low = part.lower()
+    if low.startswith('mouse') or low.startswith('m(') or low.startswith('m '):
+        toks = _split_spans(part, '|', base)
+        tstart, tend, first = toks[0]
+        if not MOUSE_TARGET_RE.match(first):
+            diags.append((tstart, tend, 'error', "bad mouse target '%s' (expected mouse or mouse(x,y))" % first))
+        _lint_modifiers(toks[1:], MOUSE_MODIFIERS, diags)
+    elif low != 'stop' and low != 'sync' and not low.startswith('sync='):
+        for istart, iend, item in _split_spans(part, ',', base):
+            toks = _split_spans(item, '|', istart)
+            if not toks:
+                continue
+            kstart, kend, keys = toks[0]
+            if keys[:4].lower() == 'type':
+                if not TYPE_RE.match(keys):
+                    diags.append((kstart, kend, 'error', 'malformed type action (expected type="text")'))
+                _lint_modifiers(toks[1:], TYPE_MODIFIERS, diags)
+                continue
+            for nstart, nend, name in _split_spans(keys, '+', kstart):
+                if name.lower() not in KEY_NAMES and len(name) != 1:
+                    diags.append((nstart, nend, 'error', "unknown key '%s'" % name))
+            _lint_modifiers(toks[1:], KB_MODIFIERS, diags)
+    parsed = parse_chant(part)
+    return (parsed[0] if parsed else []), diags
+
+def lint_step(text, base=0):
+    actions = []
+    diags = []
+    for pstart, pend, part in _split_spans(text, '||', base):
+        part_actions, part_diags = lint_part(part, pstart)
+        actions.extend(part_actions)
+        diags.extend(part_diags)
+    return actions, diags
+
+def _lint_sync_names(sync_parts, steps, diags):
+    # sync=name for a lane no action uses is a no-op at runtime, usually a typo.
+    lanes = set(act.get('lane') for step in steps for act in step)
+    for pstart, part in sync_parts:
+        for nstart, nend, name in _split_spans(part[5:], ',', pstart + 5):
+            if name.lower() not in lanes:
+                diags.append((nstart, nend, 'warning', "sync waits for lane '%s', which no action uses" % name))
+    diags.sort(key=lambda d: d[0])
+
+class ChantValidator:
+    def __init__(self, max_cache=2048):
+        self.max_cache = max_cache
+        self._parts = {}
+
+    def validate(self, raw, default_move_dur=200, global_ms=100):
+        steps = []
+        diags = []
+        old = self._parts
+        cache = {}
+        sync_parts = []
+        for sstart, send, text in _split_spans(raw, ';'):
+            actions = []
+            for pstart, pend, part in _split_spans(text, '||', sstart):
+                if part[:5].lower() == 'sync=':
+                    sync_parts.append((pstart, part))
+                hit = cache.get(part)
+                if hit is None:
+                    hit = old.pop(part, None)
+                    if hit is None:
+                        hit = lint_part(part)
+                    cache[part] = hit
+                actions.extend(hit[0])
+                diags.extend((a + pstart, b + pstart, sev, msg) for a, b, sev, msg in hit[1])
+            if actions:
+                steps.append(actions)
+        # Every part of the current text stays cached however long the chant
+        # is, plus up to max_cache parts that just left it, so undo is cheap.
+        self._parts = dict(list(old.items())[-self.max_cache:]) if old else {}
+        self._parts.update(cache)
+        if sync_parts:
+            _lint_sync_names(sync_parts, steps, diags)
+        return steps, diags, estimate_chant_ms(steps, default_move_dur, global_ms)
+
+def lint_chant(raw, default_move_dur=200, global_ms=100):
+    steps = []
+    diags = []
+    sync_parts = []
+    for sstart, send, text in _split_spans(raw, ';'):
+        actions, step_diags = lint_step(text, sstart)
+        diags.extend(step_diags)
+        if actions:
+            steps.append(actions)
+        if 'sync=' in text.lower():
+            sync_parts.extend((p, part) for p, _, part in _split_spans(text, '||', sstart) if part[:5].lower() == 'sync=')
+    if sync_parts:
+        _lint_sync_names(sync_parts, steps, diags)
+    calls = 0
+    for step in steps:
+        if any(act.get('device') == 'stop' for act in step):
+            break
+        calls += sum(estimate_action_calls(act, default_move_dur) for act in step)
+    return {
+        'steps': steps,
+        'diagnostics': diags,
+        'cycle_ms': estimate_chant_ms(steps, default_move_dur, global_ms),
+        'backend_calls': calls,
+    }
+
+def _key_to_json(k):
+    if isinstance(k, Key):
+        return {'special': k.name}
+    return k
+
+def _key_from_json(k):
+    if isinstance(k, dict):
+        return Key[k['special']]
+    return k
+
+def compile_chant(steps):
+    out = []
+    for step in steps:
+        enc = []
+        for act in step:
+            act = dict(act)
+            if 'keys' in act:
+                act['keys'] = [_key_to_json(k) for k in act['keys']]
+            if 'chars' in act:
+                act['chars'] = [[_key_to_json(k), shifted] for k, shifted in act['chars']]
+            if act.get('pos') is not None:
+                act['pos'] = list(act['pos'])
+            enc.append(act)
+        out.append(enc)
+    return {'format': 'smkb-chant', 'version': 1, 'steps': out}
+
+def load_compiled_chant(path):
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('format') != 'smkb-chant' or data.get('version') != 1:
+        raise ValueError('%s: not a compiled SMKB chant' % path)
+    steps = []
+    for step in data['steps']:
+        dec = []
+        for act in step:
+            if 'keys' in act:
+                act['keys'] = [_key_from_json(k) for k in act['keys']]
+            if 'chars' in act:
+                act['chars'] = tuple((_key_from_json(k), bool(shifted)) for k, shifted in act['chars'])
+            if act.get('pos') is not None:
+                act['pos'] = tuple(act['pos'])
+            dec.append(act)
+        steps.append(dec)
+    return steps
+
+def _offset_to_linecol(text, offset):
+    line = text.count('\n', 0, offset) + 1
+    return line, offset - (text.rfind('\n', 0, offset) + 1) + 1
+
+def _lint_file(path, root, emit_dir, default_move_dur, global_ms):
+    try:
+        with open(path, encoding='utf-8') as f:
+            raw = f.read()
+    except (OSError, UnicodeDecodeError) as e:
+        return {'path': path, 'diagnostics': [(0, 0, 1, 1, 'error', 'cannot read: %s' % e)], 'cycle_ms': 0, 'backend_calls': 0, 'steps': 0}
+    res = lint_chant(raw, default_move_dur, global_ms)
+    diags = [(start, end) + _offset_to_linecol(raw, start) + (sev, msg) for start, end, sev, msg in res['diagnostics']]
+    out = {'path': path, 'diagnostics': diags, 'cycle_ms': res['cycle_ms'], 'backend_calls': res['backend_calls'], 'steps': len(res['steps'])}
+    if emit_dir and not any(d[4] == 'error' for d in diags):
+        rel = os.path.relpath(path, root) if root != path else os.path.basename(path)
+        target = os.path.join(emit_dir, rel + '.json')
+        os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+        data = compile_chant(res['steps'])
+        data.update(source=rel, cycle_ms=res['cycle_ms'], backend_calls=res['backend_calls'])
+        tmp = target + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp, target)
+        except BaseException:
+            try: os.unlink(tmp)
+            except OSError: pass
+            raise
+        out['artifact'] = target
+    return out
+
+def _collect_chant_files(paths, pattern):
+    found = []
+    for p in paths:
+        if os.path.isdir(p):
+            for dirpath, dirnames, filenames in os.walk(p):
+                dirnames.sort()
+                for fn in sorted(filenames):
+                    if fnmatch.fnmatch(fn, pattern):
+                        found.append((os.path.join(dirpath, fn), p))
+        else:
+            found.append((p, p))
+    return found
+
+def lint_paths(paths, jobs=None, emit_dir=None, pattern='*.chant', default_move_dur=200, global_ms=100, out=sys.stdout):
+    files = _collect_chant_files(paths, pattern)
+    if not files:
+        print('No chant files found', file=out)
+        return 0
+    n_err = n_warn = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(_lint_file, path, root, emit_dir, default_move_dur, global_ms) for path, root in files]
+        for (path, _), fut in zip(files, futures):
+            try:
+                res = fut.result()
+            except Exception as e:
+                res = {'path': path, 'diagnostics': [(0, 0, 1, 1, 'error', 'lint failed: %s: %s' % (type(e).__name__, e))], 'cycle_ms': 0, 'backend_calls': 0, 'steps': 0}
+            for start, end, line, col, sev, msg in res['diagnostics']:
+                print('%s:%d:%d: %s: %s [%d-%d]' % (res['path'], line, col, sev, msg, start, end), file=out)
+                if sev == 'error': n_err += 1
+                else: n_warn += 1
+            print('%s: %d steps, ~%.1f s/cycle, %d backend calls/cycle%s' % (
+                res['path'], res['steps'], res['cycle_ms'] / 1000.0, res['backend_calls'],
+                ' -> ' + res['artifact'] if res.get('artifact') else ''), file=out)
+    print('%d files, %d errors, %d warnings' % (len(files), n_err, n_warn), file=out)
+    return 1 if n_err else 0
+
+def parse_rate(s, default=(10.0, 10.0)):
+    parts = [p.strip() for p in (s or '').split(',') if p.strip()]
+    try:
+        if len(parts) == 1:
+            v = float(parts[0]); return (v, v)
+        elif len(parts) >= 2:
+            return (float(parts[0]), float(parts[1]))
+    except ValueError:
+        pass
+    return default
+
+class RateGenerator:
+    def __init__(self, rate_range, stop_event, clock=None, rng=random, resync_s=0.25):
+        lo, hi = rate_range
+        self.lo = max(0.1, min(lo, hi))
+        self.hi = max(self.lo, hi)
+        self.stop_event = stop_event
+        self.clock = clock or RealClock()
+        self.rng = rng
+        self.spin_s = self.clock.spin_s
+        self.resync_s = resync_s
+        self.overhead = 0.0
+        self.resyncs = 0
+        self._next = None
+        self._first = None
+        self._last = None
+        self.n = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def wait(self):
+        clock = self.clock
+        now = clock.now()
+        if self._next is None:
+            self._next = now
+        else:
+            self._next += 1.0 / self.rng.uniform(self.lo, self.hi)
+            if now - self._next > self.resync_s:
+                self._next = now
+                self.resyncs += 1
+        target = self._next - self.overhead
+        se = self.stop_event
+        while True:
+            if se.is_set(): return False
+            rem = target - clock.now()
+            if rem <= 0: return True
+            if rem > self.spin_s:
+                clock.sleep(min(0.02, rem - self.spin_s))
+            else:
+                clock.sleep(0)
+
+    def dispatched(self, t_start, t_end):
+        self.overhead += 0.2 * ((t_end - t_start) - self.overhead)
+        if self._last is not None:
+            dt = t_end - self._last
+            self.n += 1
+            d = dt - self._mean
+            self._mean += d / self.n
+            self._m2 += d * (dt - self._mean)
+        else:
+            self._first = t_end
+        self._last = t_end
+
+    def stats(self):
+        span = (self._last - self._first) if self.n else 0.0
+        var = self._m2 / (self.n - 1) if self.n > 1 else 0.0
+        return {
+            'target_cps': (self.lo + self.hi) / 2.0,
+            'achieved_cps': self.n / span if span > 0 else 0.0,
+            'interval_mean_ms': self._mean * 1000.0,
+            'interval_var_ms2': var * 1e6,
+            'interval_sd_ms': math.sqrt(var) * 1000.0,
+            'overhead_ms': self.overhead * 1000.0,
+            'events': self.n + 1 if self._last is not None else 0,
+            'resyncs': self.resyncs,
+        }
+
 def ease_out_cubic(t: float) -> float:
     return 1 - pow(1 - t, 3)
 
@@ -172,217 +1556,283 @@ def ease_in_out_cubic(t: float) -> float:
     if t < 0.5: return 4 * t * t * t
     else: return 1 - pow(-2 * t + 2, 3) / 2
 
-class App:
-    def __init__(self, master):
-        self.master = master
-        master.title('Auto Input Controller — Chant + Ribbon')
-        self.controller = AutoController()
+class _Var:
+    def __init__(self, value=''):
+        self._value = value
+
+    def get(self):
+        return self._value
+
+    def set(self, value):
+        self._value = value
+
+FLAG_VALUES = {'1': 1, 'true': 1, 'yes': 1, 'on': 1, '0': 0, 'false': 0, 'no': 0, 'off': 0}
+
+def _coerce_setting(name, value, kind, default):
+    if isinstance(default, int):
+        if isinstance(value, (bool, int)) and int(value) in (0, 1):
+            return int(value)
+        if isinstance(value, str) and value.strip().lower() in FLAG_VALUES:
+            return FLAG_VALUES[value.strip().lower()]
+        raise ValueError('%s: expected 0/1/true/false, got %r' % (name, value))
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError('%s: expected a string or number, got %r' % (name, value))
+    text = str(value).strip()
+    if kind is None or (not text and kind in ('int', 'range', 'rate', 'pos')):
+        return text
+    if isinstance(kind, tuple):
+        if text.lower() not in kind:
+            raise ValueError('%s: expected one of %s, got %r' % (name, '/'.join(kind), value))
+        return text.lower()
+    parts = [p.strip() for p in text.split(',')]
+    try:
+        if kind == 'int':
+            if int(text) < 0: raise ValueError
+        elif kind == 'range':
+            nums = [int(p) for p in parts]
+            if len(nums) > 2 or nums[0] > nums[-1]: raise ValueError
+        elif kind == 'rate':
+            nums = [float(p) for p in parts]
+            if len(nums) > 2 or min(nums) <= 0 or not all(map(math.isfinite, nums)): raise ValueError
+        elif kind == 'pos':
+            if len(parts) != 2: raise ValueError
+            [int(p) for p in parts]
+    except ValueError:
+        expected = {'int': 'a non-negative integer', 'range': 'N or LOW,HIGH integers', 'rate': 'a positive number or LOW,HIGH',
+                    'pos': 'X,Y integers'}[kind]
+        raise ValueError('%s: expected %s, got %r' % (name, expected, value)) from None
+    return text
+
+class Engine:
+    SETTINGS = {
+        'global_fixed_ms': '100', 'global_jitter': '0,0', 'chant_text': '',
+        'enable_kb': 1, 'kb_sequence': 'w+d,w,a,s|repeat=2', 'kb_mode': 'single', 'kb_param': '100',
+        'kb_delay_fixed': '50', 'kb_jitter': '0,20', 'pair_switch_ms': '30',
+        'enable_mouse': 1, 'mouse_mode': 'single', 'mouse_button': 'left', 'mouse_pos': '', 'mouse_jitter_px': '5',
+        'mouse_param': '100', 'mouse_delay_fixed': '50', 'mouse_jitter': '0,20',
+        'move_style': 'ease-out', 'move_dur': '200', 'overshoot_px': '8,20', 'axis_offset_px': '0,6',
+        'action_fixed': '20', 'action_jitter': '0,10', 'low_latency': 0,
+    }
+    # How check_settings validates each value; anything not listed is free text.
+    SETTING_KINDS = {
+        'enable_kb': 'flag', 'enable_mouse': 'flag', 'low_latency': 'flag',
+        'global_fixed_ms': 'int', 'kb_delay_fixed': 'int', 'pair_switch_ms': 'int', 'mouse_jitter_px': 'int',
+        'mouse_delay_fixed': 'int', 'move_dur': 'int', 'action_fixed': 'int',
+        'global_jitter': 'range', 'kb_jitter': 'range', 'mouse_jitter': 'range', 'action_jitter': 'range',
+        'overshoot_px': 'range', 'axis_offset_px': 'range',
+        'kb_param': 'rate', 'mouse_param': 'rate', 'mouse_pos': 'pos',
+        'kb_mode': ('single', 'hold', 'cps', 'rate'), 'mouse_mode': ('single', 'hold', 'cps', 'move', 'rate'),
+        'mouse_button': ('left', 'right'), 'move_style': ('linear', 'ease-out', 'ease-out+overshoot'),
+    }
+    GC_SAFETY_THRESHOLD = 100000
+
+    def __init__(self, controller=None, clock=None):
+        self.controller = controller or AutoController()
+        self.clock = _PausableClock(clock or RealClock(), self.controller.gate)
+        self.rng = random
         self._pressed_keys = set()
         self._pressed_buttons = set()
-        self.style = ttk.Style(master)
+        self.rate_stats = {}
+        self.compiled_steps = None
+        self.arbiter = None
+        self._slot_ms = 0
+        self.resuming = False
+        self._resume_lock = threading.Lock()
+        self.cycles = 0
+        self._listeners = []
+        self._gc_state = None
+        self._blocks_mark = 0
+        self._pc = None
+        self._live = {}
+        self._move_target = None
+        for name, value in self.SETTINGS.items():
+            setattr(self, name, _Var(value))
+
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    def remove_listener(self, fn):
+        if fn in self._listeners:
+            self._listeners.remove(fn)
+
+    def _emit(self, event, **data):
+        for fn in list(self._listeners):
+            try: fn(event, data)
+            except Exception as e: print('Listener error:', e)
+
+    @classmethod
+    def check_settings(cls, settings):
+        # Returns the settings converted to their defaults' types; raises
+        # ValueError naming the first bad one. Nothing is applied here.
+        if not isinstance(settings, dict):
+            raise ValueError('settings must be an object of name: value')
+        unknown = [k for k in settings if k not in cls.SETTINGS]
+        if unknown:
+            raise ValueError('unknown setting(s): ' + ', '.join(sorted(map(str, unknown))))
+        return dict((k, _coerce_setting(k, v, cls.SETTING_KINDS.get(k), cls.SETTINGS[k])) for k, v in settings.items())
+
+    def apply_settings(self, settings):
+        for k, v in self.check_settings(settings).items():
+            getattr(self, k).set(v)
+
+    def load_chant(self, text=None, compiled_steps=None):
+        self.compiled_steps = compiled_steps
+        self.chant_text.set(text or '')
+        self._emit('loaded', steps=len(self._chant_steps()))
+
+    def _chant_steps(self):
+        if self.compiled_steps is not None:
+            return self.compiled_steps
+        return parse_chant(self.chant_text.get().strip())
+
+    def start(self):
+        if self.controller.running:
+            return False
+        self.cycles = 0
+        self._pc = None
+        self._live.clear()
+        self.controller.start(self._job)
+        self._emit('started')
+        return True
+
+    def _job(self, stop_event):
+        self._gc_enter()
         try:
-            self.style.theme_use('clam')
-        except Exception:
-            pass
-        master.configure(bg='#2b2b2b')
-        self.style.configure('.', background='#2b2b2b', foreground='#e6e6e6', font=('Segoe UI', 10), relief='flat')
-        self.style.configure('TFrame', background='#2b2b2b')
-        self.style.configure('TLabelFrame', background='#2b2b2b', foreground='#e6e6e6')
-        self.style.configure('TLabel', background='#2b2b2b', foreground='#e6e6e6')
-        self.style.configure('TEntry', fieldbackground='#3a3a3a', background='#3a3a3a', foreground='#ffffff')
-        self.style.configure('TButton', background='#444444', foreground='#ffffff')
-        self.style.map('TButton', background=[('active', '#555555'), ('pressed', '#333333')])
-        pad = {'padx': 6, 'pady': 6}
-        notebook = ttk.Notebook(master)
-        notebook.grid(row=0, column=0, sticky='nsew', padx=6, pady=6)
-        tab_home = ttk.Frame(notebook)
-        tab_kb = ttk.Frame(notebook)
-        tab_mouse = ttk.Frame(notebook)
-        notebook.add(tab_home, text='Home')
-        notebook.add(tab_kb, text='Keyboard')
-        notebook.add(tab_mouse, text='Mouse')
-        master.grid_rowconfigure(0, weight=1)
-        master.grid_columnconfigure(0, weight=1)
-        tab_home.grid_columnconfigure(0, weight=1)
-        tab_kb.grid_columnconfigure(0, weight=1)
-        tab_mouse.grid_columnconfigure(0, weight=1)
-        hk_frame = ttk.LabelFrame(tab_home, text='Hotkey')
-        hk_frame.grid(row=0, column=0, sticky='ew', **pad)
-        hk_frame.columnconfigure(1, weight=1)
-        self.hotkey_str = StringVar(value='ctrl+shift+m')
-        ttk.Label(hk_frame, text='Toggle Hotkey (example: ctrl+shift+m)').grid(row=0, column=0, sticky='w')
-        ttk.Entry(hk_frame, textvariable=self.hotkey_str).grid(row=0, column=1, sticky='ew')
-        ttk.Button(hk_frame, text='Register Hotkey', command=self.register_hotkey).grid(row=0, column=2, sticky='e')
-        global_frame = ttk.LabelFrame(tab_home, text='Global Timing')
-        global_frame.grid(row=1, column=0, sticky='ew', **pad)
-        global_frame.columnconfigure(1, weight=1)
-        ttk.Label(global_frame, text='Cycle delay fixed (ms)').grid(row=0, column=0, sticky='w')
-        self.global_fixed_ms = StringVar(value='100')
-        ttk.Entry(global_frame, textvariable=self.global_fixed_ms, width=12).grid(row=0, column=1, sticky='w')
-        ttk.Label(global_frame, text='Cycle jitter min,max (ms)').grid(row=0, column=2, sticky='w')
-        self.global_jitter = StringVar(value='0,0')
-        ttk.Entry(global_frame, textvariable=self.global_jitter, width=14).grid(row=0, column=3, sticky='w')
-        chant_frame = ttk.LabelFrame(tab_home, text='Chant (combined sequence — steps separated by ;, parallel by ||)')
-        chant_frame.grid(row=2, column=0, sticky='ew', **pad)
-        chant_frame.columnconfigure(0, weight=1)
-        self.chant_text = StringVar(value='')
-        ttk.Entry(chant_frame, textvariable=self.chant_text).grid(row=0, column=0, padx=4, pady=4, sticky='ew')
-        chant_help = (
-            "Example: mouse|hold=14000|button=left || a|hold=14000 ; mouse|rel=180|dist=50|move=1000; mouse|hold=14000|button=left || a|hold=14000 ; stop"
-        )
-        ttk.Label(chant_frame, text=chant_help).grid(row=1, column=0, sticky='w')
-        ctrl_frame = ttk.Frame(tab_home)
-        ctrl_frame.grid(row=3, column=0, sticky='ew', **pad)
-        ctrl_frame.columnconfigure(0, weight=1)
-        self.toggle_label = ttk.Label(ctrl_frame, text='State: OFF')
-        self.toggle_label.grid(row=0, column=0, sticky='w')
-        ttk.Button(ctrl_frame, text='Start', command=self.gui_start).grid(row=0, column=1, sticky='e')
-        ttk.Button(ctrl_frame, text='Stop', command=self.gui_stop).grid(row=0, column=2, sticky='e')
-        ttk.Button(ctrl_frame, text='Quit', command=self.quit).grid(row=0, column=3, sticky='e')
-        kb_frame = ttk.LabelFrame(tab_kb, text='Keyboard')
-        kb_frame.grid(row=0, column=0, sticky='ew', **pad)
-        kb_frame.columnconfigure(1, weight=1)
-        self.enable_kb = IntVar(value=1)
-        ttk.Checkbutton(kb_frame, text='Enable Keyboard', variable=self.enable_kb).grid(row=0, column=0, sticky='w')
-        ttk.Label(kb_frame, text='Sequence (comma-separated)').grid(row=1, column=0, sticky='w')
-        self.kb_sequence = StringVar(value='w+d,w,a,s|repeat=2')
-        ttk.Entry(kb_frame, textvariable=self.kb_sequence).grid(row=1, column=1, columnspan=3, sticky='ew')
-        ttk.Label(kb_frame, text='Mode').grid(row=2, column=0, sticky='w')
-        self.kb_mode = StringVar(value='single')
-        ttk.OptionMenu(kb_frame, self.kb_mode, 'single', 'single', 'hold', 'cps').grid(row=2, column=1, sticky='w')
-        ttk.Label(kb_frame, text='Param (hold ms or cps range min,max)').grid(row=2, column=2, sticky='w')
-        self.kb_param = StringVar(value='100')
-        ttk.Entry(kb_frame, textvariable=self.kb_param, width=16).grid(row=2, column=3, sticky='w')
-        ttk.Label(kb_frame, text='Per-action delay (fixed ms)').grid(row=3, column=0, sticky='w')
-        self.kb_delay_fixed = StringVar(value='50')
-        ttk.Entry(kb_frame, textvariable=self.kb_delay_fixed, width=12).grid(row=3, column=1, sticky='w')
-        ttk.Label(kb_frame, text='Per-action jitter min,max (ms)').grid(row=3, column=2, sticky='w')
-        self.kb_jitter = StringVar(value='0,20')
-        ttk.Entry(kb_frame, textvariable=self.kb_jitter, width=14).grid(row=3, column=3, sticky='w')
-        ttk.Label(kb_frame, text='Switch delay between pairs (ms)').grid(row=4, column=0, sticky='w')
-        self.pair_switch_ms = StringVar(value='30')
-        ttk.Entry(kb_frame, textvariable=self.pair_switch_ms, width=12).grid(row=4, column=1, sticky='w')
-        mouse_frame = ttk.LabelFrame(tab_mouse, text='Mouse')
-        mouse_frame.grid(row=0, column=0, sticky='ew', **pad)
-        mouse_frame.columnconfigure(1, weight=1)
-        self.enable_mouse = IntVar(value=1)
-        ttk.Checkbutton(mouse_frame, text='Enable Mouse', variable=self.enable_mouse).grid(row=0, column=0, sticky='w')
-        ttk.Label(mouse_frame, text='Mode').grid(row=1, column=0, sticky='w')
-        self.mouse_mode = StringVar(value='single')
-        ttk.OptionMenu(mouse_frame, self.mouse_mode, 'single', 'single', 'hold', 'cps', 'move').grid(row=1, column=1, sticky='w')
-        ttk.Label(mouse_frame, text='Button').grid(row=1, column=2, sticky='w')
-        self.mouse_button = StringVar(value='left')
-        ttk.OptionMenu(mouse_frame, self.mouse_button, 'left', 'left', 'right').grid(row=1, column=3, sticky='w')
-        ttk.Label(mouse_frame, text='Position (x,y) or blank').grid(row=2, column=0, sticky='w')
-        self.mouse_pos = StringVar(value='')
-        ttk.Entry(mouse_frame, textvariable=self.mouse_pos, width=16).grid(row=2, column=1, sticky='w')
-        ttk.Label(mouse_frame, text='Offset jitter px').grid(row=2, column=2, sticky='w')
-        self.mouse_jitter_px = StringVar(value='5')
-        ttk.Entry(mouse_frame, textvariable=self.mouse_jitter_px, width=8).grid(row=2, column=3, sticky='w')
-        ttk.Label(mouse_frame, text='Mouse param (hold ms or cps min,max)').grid(row=3, column=0, sticky='w')
-        self.mouse_param = StringVar(value='100')
-        ttk.Entry(mouse_frame, textvariable=self.mouse_param, width=16).grid(row=3, column=1, sticky='w')
-        ttk.Label(mouse_frame, text='Per-action delay (fixed ms)').grid(row=4, column=0, sticky='w')
-        self.mouse_delay_fixed = StringVar(value='50')
-        ttk.Entry(mouse_frame, textvariable=self.mouse_delay_fixed, width=12).grid(row=4, column=1, sticky='w')
-        ttk.Label(mouse_frame, text='Per-action jitter min,max (ms)').grid(row=4, column=2, sticky='w')
-        self.mouse_jitter = StringVar(value='0,20')
-        ttk.Entry(mouse_frame, textvariable=self.mouse_jitter, width=14).grid(row=4, column=3, sticky='w')
-        move_frame = ttk.LabelFrame(mouse_frame, text='Movement / Ease Options')
-        move_frame.grid(row=5, column=0, columnspan=4, sticky='ew', pady=(6,0))
-        move_frame.columnconfigure(1, weight=1)
-        ttk.Label(move_frame, text='Move style').grid(row=0, column=0, sticky='w')
-        self.move_style = StringVar(value='ease-out')
-        ttk.OptionMenu(move_frame, self.move_style, 'ease-out', 'linear', 'ease-out', 'ease-out+overshoot').grid(row=0, column=1, sticky='w')
-        ttk.Label(move_frame, text='Duration (ms)').grid(row=0, column=2, sticky='w')
-        self.move_dur = StringVar(value='200')
-        ttk.Entry(move_frame, textvariable=self.move_dur, width=12).grid(row=0, column=3, sticky='w')
-        ttk.Label(move_frame, text='Overshoot px min,max').grid(row=1, column=0, sticky='w')
-        self.overshoot_px = StringVar(value='8,20')
-        ttk.Entry(move_frame, textvariable=self.overshoot_px, width=16).grid(row=1, column=1, sticky='w')
-        ttk.Label(move_frame, text='Axis-offset px min,max (applied on change)').grid(row=1, column=2, sticky='w')
-        self.axis_offset_px = StringVar(value='0,6')
-        ttk.Entry(move_frame, textvariable=self.axis_offset_px, width=16).grid(row=1, column=3, sticky='w')
-        timing_frame = ttk.LabelFrame(tab_home, text='Inter-action Timing')
-        timing_frame.grid(row=4, column=0, sticky='ew', **pad)
-        timing_frame.columnconfigure(1, weight=1)
-        ttk.Label(timing_frame, text='Inter-action fixed (ms)').grid(row=0, column=0, sticky='w')
-        self.action_fixed = StringVar(value='20')
-        ttk.Entry(timing_frame, textvariable=self.action_fixed, width=12).grid(row=0, column=1, sticky='w')
-        ttk.Label(timing_frame, text='Inter-action jitter min,max (ms)').grid(row=0, column=2, sticky='w')
-        self.action_jitter = StringVar(value='0,10')
-        ttk.Entry(timing_frame, textvariable=self.action_jitter, width=14).grid(row=0, column=3, sticky='w')
-        help_frame = ttk.LabelFrame(master, text='Sequence syntax examples')
-        help_frame.grid(row=6, column=0, sticky='ew', **pad)
-        help_frame.columnconfigure(0, weight=1)
-        help_text = (
-            "Chant example:\n"
-            "mouse|hold=14000|button=left || a|hold=14000 ; mouse|rel=180|dist=50|move=1000; mouse|hold=14000|button=left || a|hold=14000 ; stop\n"
-            "If Chant is non-empty it overrides separate KB/Mouse fields. This example works for Hypixel Skyblock farms, mining 2 rows at 175 speed."
-        )
-        ttk.Label(help_frame, text=help_text).grid(row=0, column=0, sticky='w')
-        self.hotkey_listener = None
-        self.register_hotkey()
-
-    def hotkey_to_pynput(self, hk: str):
-        parts = [p.strip().lower() for p in hk.split('+') if p.strip()]
-        if not parts: return None
-        pynput_parts = []
-        for p in parts:
-            if p in ('ctrl', 'control'): pynput_parts.append('<ctrl>')
-            elif p in ('shift',): pynput_parts.append('<shift>')
-            elif p in ('alt',): pynput_parts.append('<alt>')
-            elif p in ('cmd', 'super', 'win'): pynput_parts.append('<cmd>')
-            else: pynput_parts.append(p)
-        return '+'.join(pynput_parts)
-
-    def register_hotkey(self):
-        hk = self.hotkey_str.get()
-        if self.hotkey_listener:
-            try: self.hotkey_listener.stop()
-            except: pass
-            self.hotkey_listener = None
-        try:
-            pynput_hk = self.hotkey_to_pynput(hk)
-            if not pynput_hk:
-                messagebox.showerror('Hotkey error', 'Invalid hotkey')
-                return
-            mapping = {pynput_hk: self.toggle_running}
-            self.hotkey_listener = keyboard.GlobalHotKeys(mapping)
-            self.hotkey_listener.start()
-            messagebox.showinfo('Hotkey', f'Registered hotkey: {hk}')
-        except Exception as e:
-            messagebox.showerror('Hotkey error', f'Could not register hotkey: {e}')
+            self.automation_loop(stop_event)
+        finally:
+            self._gc_exit()
+            if self.arbiter:
+                self.arbiter.release(force=True)
+            self._emit('stopped', cycles=self.cycles)
 
-    def gui_start(self):
-        if self.controller.running:
-            messagebox.showinfo('Already running', 'Automation already running')
+    def _gc_enter(self):
+        # Low-latency mode: move everything alive at start (GUI, engine, parsed
+        # chant) out of the collector's view and only collect between cycles.
+        # Automatic collection stays on behind a high threshold as a safety net.
+        self._blocks_mark = sys.getallocatedblocks()
+        try: low_latency = int(self.low_latency.get() or 0)
+        except (TypeError, ValueError): low_latency = 0
+        if not low_latency:
             return
-        self.toggle_running()
+        self._gc_state = gc.get_threshold()
+        gc.collect()
+        gc.freeze()
+        gc.set_threshold(self.GC_SAFETY_THRESHOLD, *self._gc_state[1:])
+        self._blocks_mark = sys.getallocatedblocks()
 
-    def gui_stop(self):
-        if not self.controller.running:
-            messagebox.showinfo('Not running', 'Automation not running')
+    def _gc_exit(self):
+        if self._gc_state is None:
             return
-        self.toggle_running()
+        gc.set_threshold(*self._gc_state)
+        gc.unfreeze()
+        self._gc_state = None
 
-    def toggle_running(self):
+    def stop(self):
         if not self.controller.running:
-            self.toggle_label.config(text='State: ON')
-            job = self.automation_loop
-            self.controller.start(job)
-        else:
-            self.controller.stop()
-            self._cleanup_inputs()
-            self.toggle_label.config(text='State: OFF')
-
-    def quit(self):
-        try:
-            if self.hotkey_listener: self.hotkey_listener.stop()
-        except: pass
+            return False
         self.controller.stop()
         self._cleanup_inputs()
-        self.master.quit()
+        return True
+
+    def pause(self):
+        if not self.controller.pause():
+            return False
+        if self.arbiter:
+            self.arbiter.release(force=True)
+        self._emit('paused', step=None if self._pc is None else self._pc + 1)
+        return True
+
+    def resume(self):
+        if not self.paused:
+            return False
+        t0 = time.perf_counter()
+        if self.arbiter:
+            # Input is replayed on resume, so wait for the slot first.
+            self.arbiter.acquire(self._slot_ms, self.controller._stop_event)
+        if not self.controller.resume(t0):
+            return False
+        self._emit('resumed', step=None if self._pc is None else self._pc + 1)
+        return True
+
+    def resume_async(self):
+        # For callers that must not block (GUI, daemon handler): the arbiter
+        # wait and resume run on a worker thread.
+        with self._resume_lock:
+            if not self.paused or self.resuming:
+                return False
+            self.resuming = True
+        def run():
+            try: self.resume()
+            finally: self.resuming = False
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    @property
+    def paused(self):
+        return self.controller.running and self.controller.gate.paused
+
+    def state(self):
+        if not self.controller.running: return 'stopped'
+        if self.resuming: return 'resuming'
+        return 'paused' if self.controller.gate.paused else 'running'
+
+    def _acquire_slot(self, est_ms, stop_event, busy=False):
+        # A grant that lands during a pause is handed back; resume() asks again.
+        self._slot_ms = est_ms
+        while True:
+            self.clock.sleep(0)
+            waited = self.arbiter.acquire(est_ms, stop_event, busy)
+            if not self.paused or stop_event.is_set():
+                return waited
+            self.arbiter.release(force=True)
+
+    def progress(self):
+        now = self.clock.now()
+        actions = []
+        for raw, i, n, hold_until in list(self._live.values()):
+            a = {'action': raw, 'repeat': i, 'of': n}
+            if hold_until is not None:
+                a['hold_left_ms'] = round(max(0.0, hold_until - now) * 1000.0, 1)
+            actions.append(a)
+        saved = self.controller.gate.saved
+        return {
+            'step': None if self._pc is None else self._pc + 1,
+            'actions': actions,
+            'cursor_target': self._move_target,
+            'cursor': saved[2] if saved else None,
+        }
+
+    def _cycle_done(self, elapsed):
+        self.cycles += 1
+        _M_CYCLES.inc()
+        _M_CYCLE_SECONDS.observe(elapsed)
+        _M_CYCLE_BLOCKS.observe(sys.getallocatedblocks() - self._blocks_mark)
+        if self._gc_state is not None:
+            gc.collect()
+        self._blocks_mark = sys.getallocatedblocks()
+        self._emit('cycle', cycle=self.cycles, seconds=elapsed)
+
+    def status(self):
+        steps = self._chant_steps()
+        try: move_dur = int(self.move_dur.get())
+        except: move_dur = 200
+        try: global_ms = int(self.global_fixed_ms.get() or 0)
+        except: global_ms = 0
+        return {
+            'running': self.controller.running,
+            'paused': self.paused,
+            'resuming': self.resuming,
+            'progress': self.progress(),
+            'cycles': self.cycles,
+            'chant': self.chant_text.get(),
+            'compiled': self.compiled_steps is not None,
+            'steps': len(steps),
+            'est_cycle_ms': estimate_chant_ms(steps, move_dur, global_ms),
+            'realtime': self.controller.realtime_status,
+        }
+
+    def stats(self):
+        return {'metrics': METRICS.snapshot(), 'rate': dict(self.rate_stats)}
 
     def automation_loop(self, stop_event: threading.Event):
         def parse_range(s, default=(0,0)):
@@ -414,81 +1864,161 @@ class App:
         axis_offset_range = parse_range(self.axis_offset_px.get(), (0,0))
         move_style = self.move_style.get()
         chant_raw = self.chant_text.get().strip()
-        if chant_raw:
-            chant_steps = parse_chant(chant_raw)
+        if chant_raw or self.compiled_steps is not None:
+            chant_steps = self._chant_steps()
+            if not chant_steps:
+                self._cleanup_inputs()
+                return
+            nominal = ms_to_sec(estimate_chant_ms(chant_steps, move_dur, global_fixed + sum(global_jitter) / 2.0))
+            boundary_due = None
+            lanes = {}
+            step_ms = estimate_step_ms(chant_steps, move_dur, global_fixed + sum(global_jitter) / 2.0)
+            plans = [self._step_plan(step, move_style, move_dur, overshoot_range, axis_offset_range, stop_event) for step in chant_steps]
+            threads = []
             while not stop_event.is_set():
-                for step in chant_steps:
+                cycle_start = self.clock.now()
+                for si, (stop_found, actions, syncs) in enumerate(plans):
                     if stop_event.is_set(): break
-                    stop_found = any(act.get('device') == 'stop' for act in step)
+                    self._pc = si
                     if stop_found:
+                        self._join_all(lanes.values(), stop_event)
+                        if not stop_event.is_set():
+                            # Reaching stop completes the cycle.
+                            elapsed = self.clock.now() - cycle_start
+                            _M_CYCLE_DRIFT.observe(elapsed - nominal)
+                            self._cycle_done(elapsed)
                         stop_event.set()
                         self._cleanup_inputs()
                         return
-                    threads = []
-                    for act in step:
-                        if act.get('device') == 'kb':
-                            t = threading.Thread(target=self._kb_action_once, args=(act, stop_event), daemon=True)
-                            threads.append(t); t.start()
-                        elif act.get('device') == 'mouse':
-                            t = threading.Thread(target=self._mouse_action_from_chant, args=(act, move_style, move_dur, overshoot_range, axis_offset_range, stop_event), daemon=True)
-                            threads.append(t); t.start()
-                    for t in threads:
-                        while t.is_alive():
-                            if stop_event.is_set(): break
-                            t.join(timeout=0.05)
-                    total_global = global_fixed + random.randint(*global_jitter)
+                    if self.arbiter:
+                        waited = self._acquire_slot(step_ms[si], stop_event, any(t.is_alive() for t in lanes.values()))
+                        if waited and boundary_due is not None: boundary_due += waited
+                    step_start = self.clock.now()
+                    del threads[:]
+                    for fn, fargs, counter, lane, offset in actions:
+                        counter.inc()
+                        if lane or offset:
+                            due = step_start + ms_to_sec(offset)
+                            t = self.clock.spawn(self._timeline_action, (lanes.get(lane) if lane else None, due, fn, fargs, stop_event))
+                        else:
+                            t = self.clock.spawn(fn, fargs)
+                        if lane: lanes[lane] = t
+                        else: threads.append(t)
+                    for sy in syncs:
+                        for name in (sy.get('lanes') or list(lanes)):
+                            if name in lanes: threads.append(lanes.pop(name))
+                    if boundary_due is not None:
+                        _M_STEP_LATENCY.observe(max(0.0, self.clock.now() - boundary_due))
+                    self._join_all(threads, stop_event)
+                    if self.arbiter and not any(t.is_alive() for t in lanes.values()):
+                        self.arbiter.release()
+                    total_global = global_fixed + self.rng.randint(*global_jitter)
+                    boundary_due = self.clock.now() + ms_to_sec(total_global)
                     self._sleep_ms(total_global, stop_event)
+                else:
+                    self._join_all(lanes.values(), stop_event)
+                    lanes.clear()
+                    if self.arbiter: self.arbiter.release()
+                    if stop_event.is_set(): continue
+                    elapsed = self.clock.now() - cycle_start
+                    _M_CYCLE_DRIFT.observe(elapsed - nominal)
+                    self._cycle_done(elapsed)
             self._cleanup_inputs()
             return
+        rate_threads = []
+        if self.enable_kb.get() and self.kb_mode.get() == 'rate':
+            kb_actions = parse_sequence(self.kb_sequence.get())
+            if kb_actions:
+                rate_threads.append(self.clock.spawn(self._kb_rate_worker, (stop_event, kb_actions, parse_rate(self.kb_param.get()))))
+        if self.enable_mouse.get() and self.mouse_mode.get() == 'rate':
+            btn_obj = MouseButton.left if self.mouse_button.get() == 'left' else MouseButton.right
+            mouse_pos = self._parse_pos(self.mouse_pos.get())
+            rate_threads.append(self.clock.spawn(self._mouse_rate_worker, (stop_event, mouse_pos, int(self.mouse_jitter_px.get() or 0), parse_rate(self.mouse_param.get()), btn_obj)))
+        kb_seq_raw = None
         while not stop_event.is_set():
-            enable_kb = bool(self.enable_kb.get())
-            enable_mouse = bool(self.enable_mouse.get())
-            kb_seq_raw = self.kb_sequence.get()
-            kb_actions = parse_sequence(kb_seq_raw)
+            cycle_start = self.clock.now()
+            enable_kb = bool(self.enable_kb.get()) and self.kb_mode.get() != 'rate'
+            enable_mouse = bool(self.enable_mouse.get()) and self.mouse_mode.get() != 'rate'
+            if rate_threads and not (enable_kb or enable_mouse):
+                self.clock.sleep(0.05)
+                continue
+            if self.kb_sequence.get() != kb_seq_raw:
+                kb_seq_raw = self.kb_sequence.get()
+                kb_actions = parse_sequence(kb_seq_raw)
             mmode = self.mouse_mode.get()
             btn = self.mouse_button.get()
             btn_obj = MouseButton.left if btn == 'left' else MouseButton.right
-            mouse_pos_raw = self.mouse_pos.get().strip()
-            def parse_mouse_pos(raw):
-                if not raw:
-                    return None
-                try:
-                    x_str, y_str = [s.strip() for s in raw.split(',')]
-                    return (int(x_str), int(y_str))
-                except:
-                    return None
-            mouse_pos = parse_mouse_pos(mouse_pos_raw)
+            mouse_pos = self._parse_pos(self.mouse_pos.get())
+            if self.arbiter:
+                self._acquire_slot(0, stop_event)
             need_move = False
             if mouse_pos and mmode in ('single','hold','cps','move'):
                 need_move = True
             move_thread = None
             if enable_mouse and need_move:
                 dur_ms = move_dur
-                move_thread = threading.Thread(
-                    target=self._mouse_move_to,
-                    args=(mouse_pos, int(self.mouse_jitter_px.get() or 0), dur_ms, move_style, overshoot_range, axis_offset_range, stop_event),
-                    daemon=True
+                move_thread = self.clock.spawn(
+                    self._mouse_move_to,
+                    (mouse_pos, int(self.mouse_jitter_px.get() or 0), dur_ms, move_style, overshoot_range, axis_offset_range, stop_event)
                 )
-                move_thread.start()
             threads = []
             if enable_kb and kb_actions:
-                t_kb = threading.Thread(target=self._kb_worker, args=(stop_event, kb_actions, self.kb_mode.get(), self._parse_range_from_string(self.kb_param.get()), int(self.kb_delay_fixed.get() or 0), self._parse_range_from_string(self.kb_jitter.get()), int(self.pair_switch_ms.get() or 0), int(action_fixed or 0), self._parse_range_from_string(self.action_jitter.get())), daemon=True)
-                threads.append(t_kb); t_kb.start()
+                t_kb = self.clock.spawn(self._kb_worker, (stop_event, kb_actions, self.kb_mode.get(), self._parse_range_from_string(self.kb_param.get()), int(self.kb_delay_fixed.get() or 0), self._parse_range_from_string(self.kb_jitter.get()), int(self.pair_switch_ms.get() or 0), int(action_fixed or 0), self._parse_range_from_string(self.action_jitter.get())))
+                threads.append(t_kb)
             if enable_mouse:
-                t_mouse = threading.Thread(target=self._mouse_worker, args=(stop_event, mmode, mouse_pos, int(self.mouse_jitter_px.get() or 0), self._parse_range_from_string(self.mouse_param.get()), int(self.mouse_delay_fixed.get() or 0), self._parse_range_from_string(self.mouse_jitter.get()), btn_obj, int(self.pair_switch_ms.get() or 0), int(action_fixed or 0), self._parse_range_from_string(self.action_jitter.get())), daemon=True)
-                threads.append(t_mouse); t_mouse.start()
-            for t in threads:
-                while t.is_alive():
-                    if stop_event.is_set(): break
-                    t.join(timeout=0.05)
+                t_mouse = self.clock.spawn(self._mouse_worker, (stop_event, mmode, mouse_pos, int(self.mouse_jitter_px.get() or 0), self._parse_range_from_string(self.mouse_param.get()), int(self.mouse_delay_fixed.get() or 0), self._parse_range_from_string(self.mouse_jitter.get()), btn_obj, int(self.pair_switch_ms.get() or 0), int(action_fixed or 0), self._parse_range_from_string(self.action_jitter.get())))
+                threads.append(t_mouse)
+            self._join_all(threads, stop_event)
             if move_thread:
-                while move_thread.is_alive():
-                    if stop_event.is_set(): break
-                    move_thread.join(timeout=0.05)
-            total_global = global_fixed + random.randint(*global_jitter)
+                self.clock.join(move_thread, stop_event)
+            if self.arbiter:
+                self.arbiter.release()
+            total_global = global_fixed + self.rng.randint(*global_jitter)
             self._sleep_ms(total_global, stop_event)
+            if not stop_event.is_set():
+                self._cycle_done(self.clock.now() - cycle_start)
+        for t in rate_threads:
+            self.clock.join(t)
         self._cleanup_inputs()
 
+    def _step_plan(self, step, move_style, move_dur, overshoot_range, axis_offset_range, stop_event):
+        # Built once per run so the step loop reuses the same argument tuples every cycle.
+        stop_found = any(act.get('device') == 'stop' for act in step)
+        actions = []
+        syncs = []
+        for act in step:
+            dev = act.get('device')
+            if dev == 'sync':
+                syncs.append(act)
+            elif dev == 'kb':
+                actions.append((self._kb_action_once, (act, stop_event), _M_ACTIONS_KB, act.get('lane'), act.get('offset') or 0))
+            elif dev == 'mouse':
+                actions.append((self._mouse_action_from_chant, (act, move_style, move_dur, overshoot_range, axis_offset_range, stop_event),
+                                _M_ACTIONS_MOUSE, act.get('lane'), act.get('offset') or 0))
+        return stop_found, actions, syncs
+
+    def _join_all(self, threads, stop_event):
+        for t in list(threads):
+            self.clock.join(t, stop_event)
+            if stop_event.is_set(): return
+
+    def _timeline_action(self, prev, due, fn, fargs, stop_event):
+        if prev is not None:
+            self._join_all((prev,), stop_event)
+        self._sleep_ms((due - self.clock.now()) * 1000.0, stop_event)
+        if stop_event.is_set(): return
+        fn(*fargs)
+
+    def _parse_pos(self, raw):
+        raw = raw.strip()
+        if not raw:
+            return None
+        try:
+            x_str, y_str = [s.strip() for s in raw.split(',')]
+            return (int(x_str), int(y_str))
+        except:
+            return None
+
     def _parse_range_from_string(self, s):
         s = s.strip()
         if not s:
@@ -508,25 +2038,33 @@ class App:
         simul = act.get('simul', False)
         hold = act.get('hold', None)
         repeat = act.get('repeat', 1)
+        live = self._live[id(act)] = [act.get('raw'), 0, repeat, None]
         try:
-            for _ in range(repeat):
+            for i in range(repeat):
                 if se and se.is_set(): break
+                live[1] = i + 1
+                if act.get('type') is not None:
+                    self._type_text(act, se)
+                    continue
                 if simul:
-                    for k in keys:
-                        if k is None: continue
-                        try: self.controller.kc.press(k); self._pressed_keys.add(k)
-                        except: pass
+                    with self.controller.batch():
+                        for k in keys:
+                            if k is None: continue
+                            try: self.controller.kc.press(k); self._pressed_keys.add(k)
+                            except: pass
                     if hold:
-                        waited=0.0; tgt=hold/1000.0
+                        waited=0.0; tgt=hold/1000.0; t0 = self.clock.now(); live[3] = t0 + tgt
                         while waited < tgt:
                             if se and se.is_set(): break
-                            time.sleep(min(0.02, tgt - waited)); waited += min(0.02, tgt - waited)
+                            self.clock.sleep(min(0.02, tgt - waited)); waited += min(0.02, tgt - waited)
+                        _observe_hold(self.clock.now() - t0, hold, se); live[3] = None
                     else:
-                        time.sleep(0.01)
-                    for k in reversed(keys):
-                        try: self.controller.kc.release(k)
-                        except: pass
-                        if k in self._pressed_keys: self._pressed_keys.discard(k)
+                        self.clock.sleep(0.01)
+                    with self.controller.batch():
+                        for k in reversed(keys):
+                            try: self.controller.kc.release(k)
+                            except: pass
+                            if k in self._pressed_keys: self._pressed_keys.discard(k)
                 else:
                     for k in keys:
                         if se and se.is_set(): break
@@ -534,30 +2072,65 @@ class App:
                         if hold:
                             try: self.controller.kc.press(k); self._pressed_keys.add(k)
                             except: pass
-                            waited=0.0; tgt=hold/1000.0
+                            waited=0.0; tgt=hold/1000.0; t0 = self.clock.now(); live[3] = t0 + tgt
                             while waited < tgt:
                                 if se and se.is_set(): break
-                                time.sleep(min(0.02, tgt-waited)); waited += min(0.02, tgt-waited)
+                                self.clock.sleep(min(0.02, tgt-waited)); waited += min(0.02, tgt-waited)
+                            _observe_hold(self.clock.now() - t0, hold, se); live[3] = None
                             try: self.controller.kc.release(k)
                             except: pass
                             if k in self._pressed_keys: self._pressed_keys.discard(k)
                         else:
                             try: self.controller.kc.press(k); self._pressed_keys.add(k)
                             except: pass
-                            time.sleep(0.01)
+                            self.clock.sleep(0.01)
                             try: self.controller.kc.release(k)
                             except: pass
                             if k in self._pressed_keys: self._pressed_keys.discard(k)
         except Exception as e:
             print('_kb_action_once error:', e)
         finally:
+            self._live.pop(id(act), None)
             if se and se.is_set():
                 self._cleanup_inputs()
 
+    def _type_text(self, act, stop_event):
+        cps = act.get('cps', 30.0)
+        spread = act.get('human', 0) / 100.0
+        gen = RateGenerator((cps * (1.0 - spread), cps * (1.0 + spread)), stop_event or threading.Event(), self.clock, self.rng)
+        kc = self.controller.kc
+        shift = Key.shift
+        try:
+            for key, shifted in act['chars']:
+                if not gen.wait(): break
+                t0 = self.clock.now()
+                try:
+                    with self.controller.batch():
+                        if shifted: kc.press(shift)
+                        try:
+                            kc.press(key)
+                            kc.release(key)
+                        finally:
+                            if shifted: kc.release(shift)
+                except Exception as e:
+                    print('Type error for %r: %s' % (key, e))
+                gen.dispatched(t0, self.clock.now())
+        finally:
+            self._publish_rate('type', gen)
+
     def _mouse_action_from_chant(self, act, move_style, default_move_dur, overshoot_range, axis_offset_range, stop_event=None):
         se = stop_event or getattr(self.controller, '_stop_event', None)
-        for _ in range(act.get('repeat', 1)):
+        repeat = act.get('repeat', 1)
+        live = self._live[id(act)] = [act.get('raw'), 0, repeat, None]
+        try:
+            self._mouse_chant_repeats(act, live, move_style, default_move_dur, overshoot_range, axis_offset_range, se)
+        finally:
+            self._live.pop(id(act), None)
+
+    def _mouse_chant_repeats(self, act, live, move_style, default_move_dur, overshoot_range, axis_offset_range, se):
+        for i in range(live[2]):
             if se and se.is_set(): break
+            live[1] = i + 1
 
             pos = act.get('pos', None)
             rel = act.get('rel', None)
@@ -587,12 +2160,10 @@ class App:
 
             mv_thread = None
             if pos is not None:
-                mv_thread = threading.Thread(
-                    target=self._mouse_move_to,
-                    args=(pos, int(self.mouse_jitter_px.get() or 0), int(move_ms), move_style, overshoot_range, axis_offset_range, se),
-                    daemon=True
+                mv_thread = self.clock.spawn(
+                    self._mouse_move_to,
+                    (pos, int(self.mouse_jitter_px.get() or 0), int(move_ms), move_style, overshoot_range, axis_offset_range, se)
                 )
-                mv_thread.start()
 
             hold_ms = act.get('hold', None)
             btn = MouseButton.left if act.get('button','left') == 'left' else MouseButton.right
@@ -602,7 +2173,7 @@ class App:
                 wait_target = min(0.15, move_ms / 1000.0)
                 while waited < wait_target:
                     if se and se.is_set(): break
-                    time.sleep(0.01); waited += 0.01
+                    self.clock.sleep(0.01); waited += 0.01
 
                 try:
                     self.controller.mc.press(btn)
@@ -610,10 +2181,11 @@ class App:
                 except Exception:
                     pass
 
-                start = time.time(); target = hold_ms / 1000.0
-                while (time.time() - start) < target:
+                start = self.clock.now(); target = hold_ms / 1000.0; t0 = self.clock.now(); live[3] = start + target
+                while (self.clock.now() - start) < target:
                     if se and se.is_set(): break
-                    time.sleep(0.02)
+                    self.clock.sleep(0.02)
+                _observe_hold(self.clock.now() - t0, hold_ms, se); live[3] = None
                 try:
                     self.controller.mc.release(btn)
                 except:
@@ -625,7 +2197,7 @@ class App:
                     waited = 0.0; tgt = min(0.2, move_ms / 1000.0)
                     while waited < tgt:
                         if se and se.is_set(): break
-                        time.sleep(0.01); waited += 0.01
+                        self.clock.sleep(0.01); waited += 0.01
 
                 try:
                     if pos is not None:
@@ -635,9 +2207,7 @@ class App:
                     pass
 
             if mv_thread:
-                while mv_thread.is_alive():
-                    if se and se.is_set(): break
-                    mv_thread.join(timeout=0.05)
+                self.clock.join(mv_thread, se)
 
             if se and se.is_set(): break
 
@@ -686,25 +2256,26 @@ class App:
                 for idx, act in enumerate(kb_actions):
                     if stop_event.is_set(): break
                     self._do_kb_action(act, kb_delay_fixed, kb_jitter, stop_event)
+                    _M_ACTIONS_KB.inc()
                     self._sleep_ms(pair_switch, stop_event)
-                    self._sleep_ms(action_fixed + random.randint(*action_jitter), stop_event)
+                    self._sleep_ms(action_fixed + self.rng.randint(*action_jitter), stop_event)
             elif kb_mode == 'hold':
                 hold_ms = kb_param_range[0]
                 for idx, act in enumerate(kb_actions):
                     if stop_event.is_set(): break
-                    h = act['hold'] if act['hold'] is not None else hold_ms
-                    act_copy = dict(act); act_copy['hold'] = h
-                    self._do_kb_action(act_copy, kb_delay_fixed, kb_jitter, stop_event)
+                    self._do_kb_action(act, kb_delay_fixed, kb_jitter, stop_event, hold_ms)
+                    _M_ACTIONS_KB.inc()
                     self._sleep_ms(pair_switch, stop_event)
-                    self._sleep_ms(action_fixed + random.randint(*action_jitter), stop_event)
+                    self._sleep_ms(action_fixed + self.rng.randint(*action_jitter), stop_event)
             elif kb_mode == 'cps':
                 min_ms, max_ms = kb_param_range
                 for idx, act in enumerate(kb_actions):
                     if stop_event.is_set(): break
                     self._do_kb_action(act, kb_delay_fixed, kb_jitter, stop_event)
-                    self._sleep_ms(random.randint(min_ms, max_ms), stop_event)
+                    _M_ACTIONS_KB.inc()
+                    self._sleep_ms(self.rng.randint(min_ms, max_ms), stop_event)
                     self._sleep_ms(pair_switch, stop_event)
-                    self._sleep_ms(action_fixed + random.randint(*action_jitter), stop_event)
+                    self._sleep_ms(action_fixed + self.rng.randint(*action_jitter), stop_event)
         except Exception as e:
             print('KB worker error:', e)
         finally:
@@ -716,17 +2287,20 @@ class App:
             if stop_event.is_set(): return
             if mmode == 'single':
                 self._mouse_click_at(mouse_pos, mouse_jitter_px, btn_obj)
-                self._sleep_ms(mouse_delay_fixed + random.randint(*mouse_jitter), stop_event)
-                self._sleep_ms(action_fixed + random.randint(*action_jitter), stop_event)
+                _M_ACTIONS_MOUSE.inc()
+                self._sleep_ms(mouse_delay_fixed + self.rng.randint(*mouse_jitter), stop_event)
+                self._sleep_ms(action_fixed + self.rng.randint(*action_jitter), stop_event)
             elif mmode == 'hold':
                 hold_ms = mouse_param_range[0]
                 self._mouse_hold(hold_ms, mouse_pos, mouse_jitter_px, btn_obj, stop_event)
-                self._sleep_ms(action_fixed + random.randint(*action_jitter), stop_event)
+                _M_ACTIONS_MOUSE.inc()
+                self._sleep_ms(action_fixed + self.rng.randint(*action_jitter), stop_event)
             elif mmode == 'cps':
                 min_ms, max_ms = mouse_param_range
                 self._mouse_click_at(mouse_pos, mouse_jitter_px, btn_obj)
-                self._sleep_ms(random.randint(min_ms, max_ms), stop_event)
-                self._sleep_ms(action_fixed + random.randint(*action_jitter), stop_event)
+                _M_ACTIONS_MOUSE.inc()
+                self._sleep_ms(self.rng.randint(min_ms, max_ms), stop_event)
+                self._sleep_ms(action_fixed + self.rng.randint(*action_jitter), stop_event)
             elif mmode == 'move':
                 pass
         except Exception as e:
@@ -735,40 +2309,114 @@ class App:
             if stop_event.is_set():
                 self._cleanup_inputs()
 
-    def _do_kb_action(self, act, delay_fixed, delay_jitter, stop_event=None):
+    def _publish_rate(self, device, gen, final=False):
+        st = gen.stats()
+        self.rate_stats[device] = st
+        METRICS.gauge('smkb_rate_achieved_cps', 'Achieved rate of the rate generator', device=device).set(st['achieved_cps'])
+        METRICS.gauge('smkb_rate_interval_sd_seconds', 'Standard deviation of rate generator intervals', device=device).set(st['interval_sd_ms'] / 1000.0)
+        if final and st['events']:
+            print('Rate generator (%s): target %.2f cps, achieved %.2f cps over %d events, interval %.2f ms +/- %.2f ms, dispatch overhead %.2f ms' % (
+                device, st['target_cps'], st['achieved_cps'], st['events'], st['interval_mean_ms'], st['interval_sd_ms'], st['overhead_ms']))
+
+    def _kb_rate_worker(self, stop_event, kb_actions, rate_range):
+        gen = RateGenerator(rate_range, stop_event, self.clock, self.rng)
+        kc = self.controller.kc
+        shift = Key.shift
+        try:
+            while True:
+                for act in kb_actions:
+                    if 'chars' in act:
+                        # one keystroke per character at the rate-mode rate; cps= is ignored here
+                        ticks = [[shift, key] if shifted else [key] for key, shifted in act['chars']]
+                    else:
+                        ticks = [[k for k in act.get('keys', []) if k is not None]]
+                    for keys in ticks * act.get('repeat', 1):
+                        if not gen.wait(): return
+                        t0 = self.clock.now()
+                        with self.controller.batch():
+                            for k in keys:
+                                try: kc.press(k); self._pressed_keys.add(k)
+                                except: pass
+                            for k in reversed(keys):
+                                try: kc.release(k)
+                                except: pass
+                                self._pressed_keys.discard(k)
+                        gen.dispatched(t0, self.clock.now())
+                        _M_ACTIONS_KB.inc()
+                        if gen.n % 50 == 0: self._publish_rate('kb', gen)
+        except Exception as e:
+            print('KB rate worker error:', e)
+        finally:
+            self._publish_rate('kb', gen, final=True)
+            if stop_event.is_set():
+                self._cleanup_inputs()
+
+    def _mouse_rate_worker(self, stop_event, mouse_pos, jitter_px, rate_range, btn_obj):
+        gen = RateGenerator(rate_range, stop_event, self.clock, self.rng)
+        mc = self.controller.mc
+        try:
+            while gen.wait():
+                t0 = self.clock.now()
+                try:
+                    if mouse_pos:
+                        dx = self.rng.randint(-jitter_px, jitter_px) if jitter_px else 0
+                        dy = self.rng.randint(-jitter_px, jitter_px) if jitter_px else 0
+                        mc.position = (mouse_pos[0] + dx, mouse_pos[1] + dy)
+                    mc.click(btn_obj)
+                except Exception as e:
+                    print('Mouse click error:', e)
+                gen.dispatched(t0, self.clock.now())
+                _M_ACTIONS_MOUSE.inc()
+                if gen.n % 50 == 0: self._publish_rate('mouse', gen)
+        except Exception as e:
+            print('Mouse rate worker error:', e)
+        finally:
+            self._publish_rate('mouse', gen, final=True)
+            if stop_event.is_set():
+                self._cleanup_inputs()
+
+    def _do_kb_action(self, act, delay_fixed, delay_jitter, stop_event=None, default_hold=None):
         se = stop_event or getattr(self.controller, '_stop_event', None)
         keys = act.get('keys', [])
         simul = act.get('simul', False)
         hold = act.get('hold', None)
+        if hold is None: hold = default_hold
         repeat = act.get('repeat', 1)
         for _ in range(repeat):
             if se and se.is_set(): break
+            if act.get('type') is not None:
+                self._type_text(act, se)
+                self._sleep_ms(delay_fixed + self.rng.randint(*delay_jitter), stop_event)
+                continue
             if simul:
                 try:
-                    for k in keys:
-                        if k is None: continue
-                        try: self.controller.kc.press(k); self._pressed_keys.add(k)
-                        except: pass
+                    with self.controller.batch():
+                        for k in keys:
+                            if k is None: continue
+                            try: self.controller.kc.press(k); self._pressed_keys.add(k)
+                            except: pass
                     if hold:
-                        waited=0.0; target=hold/1000.0
+                        waited=0.0; target=hold/1000.0; t0 = self.clock.now()
                         while waited < target:
                             if se and se.is_set(): break
                             sleep_chunk = min(0.02, target - waited)
-                            time.sleep(sleep_chunk); waited += sleep_chunk
+                            self.clock.sleep(sleep_chunk); waited += sleep_chunk
+                        _observe_hold(self.clock.now() - t0, hold, se)
                     else:
                         waited=0.0; target=0.01
                         while waited < target:
                             if se and se.is_set(): break
-                            time.sleep(0.01); waited += 0.01
+                            self.clock.sleep(0.01); waited += 0.01
                 except Exception as e:
                     print('Key combo press error:', e)
                 finally:
                     try:
-                        for k in reversed(keys):
-                            if k is None: continue
-                            try: self.controller.kc.release(k)
-                            except: pass
-                            if k in self._pressed_keys: self._pressed_keys.discard(k)
+                        with self.controller.batch():
+                            for k in reversed(keys):
+                                if k is None: continue
+                                try: self.controller.kc.release(k)
+                                except: pass
+                                if k in self._pressed_keys: self._pressed_keys.discard(k)
                     except Exception as e:
                         print('Key combo release error:', e)
             else:
@@ -779,11 +2427,12 @@ class App:
                         if hold:
                             try: self.controller.kc.press(k); self._pressed_keys.add(k)
                             except: pass
-                            waited=0.0; target=hold/1000.0
+                            waited=0.0; target=hold/1000.0; t0 = self.clock.now()
                             while waited < target:
                                 if se and se.is_set(): break
                                 sleep_chunk = min(0.02, target - waited)
-                                time.sleep(sleep_chunk); waited += sleep_chunk
+                                self.clock.sleep(sleep_chunk); waited += sleep_chunk
+                            _observe_hold(self.clock.now() - t0, hold, se)
                             try: self.controller.kc.release(k)
                             except: pass
                             if k in self._pressed_keys: self._pressed_keys.discard(k)
@@ -793,13 +2442,13 @@ class App:
                             waited=0.0; target=0.01
                             while waited < target:
                                 if se and se.is_set(): break
-                                time.sleep(0.01); waited += 0.01
+                                self.clock.sleep(0.01); waited += 0.01
                             try: self.controller.kc.release(k)
                             except: pass
                             if k in self._pressed_keys: self._pressed_keys.discard(k)
                     except Exception as e:
                         print('Key press error:', e)
-            self._sleep_ms(delay_fixed + random.randint(*delay_jitter), stop_event)
+            self._sleep_ms(delay_fixed + self.rng.randint(*delay_jitter), stop_event)
 
     def _mouse_click_at(self, pos, jitter_px, btn_obj):
         try:
@@ -808,11 +2457,11 @@ class App:
             else:
                 cur = self.controller.mc.position
                 tx, ty = cur
-            dx = random.randint(-jitter_px, jitter_px) if jitter_px else 0
-            dy = random.randint(-jitter_px, jitter_px) if jitter_px else 0
+            dx = self.rng.randint(-jitter_px, jitter_px) if jitter_px else 0
+            dy = self.rng.randint(-jitter_px, jitter_px) if jitter_px else 0
             tx += dx; ty += dy
             self.controller.mc.position = (tx, ty)
-            time.sleep(0.005)
+            self.clock.sleep(0.005)
             self.controller.mc.click(btn_obj)
         except Exception as e:
             print('Mouse click error:', e)
@@ -825,8 +2474,8 @@ class App:
             else:
                 cur = self.controller.mc.position
                 tx, ty = cur
-            dx = random.randint(-jitter_px, jitter_px) if jitter_px else 0
-            dy = random.randint(-jitter_px, jitter_px) if jitter_px else 0
+            dx = self.rng.randint(-jitter_px, jitter_px) if jitter_px else 0
+            dy = self.rng.randint(-jitter_px, jitter_px) if jitter_px else 0
             tx += dx; ty += dy
             self.controller.mc.position = (tx, ty)
             try:
@@ -834,11 +2483,13 @@ class App:
                 self._pressed_buttons.add(btn_obj)
             except Exception:
                 pass
-            start = time.time()
+            start = self.clock.now()
             target = ms / 1000.0
-            while (time.time() - start) < target:
+            t0 = self.clock.now()
+            while (self.clock.now() - start) < target:
                 if se and se.is_set(): break
-                time.sleep(0.01)
+                self.clock.sleep(0.01)
+            _observe_hold(self.clock.now() - t0, ms, se)
             try:
                 self.controller.mc.release(btn_obj)
             except Exception:
@@ -852,8 +2503,8 @@ class App:
         try:
             se = stop_event or getattr(self.controller, '_stop_event', None)
             tx, ty = pos
-            tx += random.randint(-jitter_px, jitter_px) if jitter_px else 0
-            ty += random.randint(-jitter_px, jitter_px) if jitter_px else 0
+            tx += self.rng.randint(-jitter_px, jitter_px) if jitter_px else 0
+            ty += self.rng.randint(-jitter_px, jitter_px) if jitter_px else 0
 
             if hasattr(self, '_last_mouse_target') and self._last_mouse_target is not None:
                 lx, ly = self._last_mouse_target
@@ -861,12 +2512,13 @@ class App:
                     ax_min, ax_max = axis_offset_range
                     if ax_max >= ax_min and ax_max > 0:
                         if tx != lx:
-                            off_x = random.randint(ax_min, ax_max)
-                            tx += random.choice((-1, 1)) * off_x
+                            off_x = self.rng.randint(ax_min, ax_max)
+                            tx += self.rng.choice((-1, 1)) * off_x
                         if ty != ly:
-                            off_y = random.randint(ax_min, ax_max)
-                            ty += random.choice((-1, 1)) * off_y
+                            off_y = self.rng.randint(ax_min, ax_max)
+                            ty += self.rng.choice((-1, 1)) * off_y
 
+            self._move_target = (int(tx), int(ty))
             start = self.controller.mc.position
             sx = float(start[0]); sy = float(start[1])
             txf = float(tx); tyf = float(ty)
@@ -880,12 +2532,7 @@ class App:
 
             total_steps = max(1, int(max(1, dur_ms) / 8))
 
-            def step_set(nx, ny):
-                try:
-                    self.controller.mc.position = (int(round(nx)), int(round(ny)))
-                except Exception:
-                    pass
-
+            step_set = self._set_position
             if style == 'linear':
                 for i in range(1, total_steps + 1):
                     if se and se.is_set(): break
@@ -905,7 +2552,7 @@ class App:
             elif style == 'ease-out+overshoot':
                 dist = math.hypot(dx, dy)
                 os_min, os_max = overshoot_range
-                overshoot_px = random.randint(os_min, os_max) if os_max >= os_min and os_max > 0 else 0
+                overshoot_px = self.rng.randint(os_min, os_max) if os_max >= os_min and os_max > 0 else 0
 
                 if dist <= 1e-6:
                     try:
@@ -967,6 +2614,12 @@ class App:
         except Exception as e:
             print('Mouse move error:', e)
 
+    def _set_position(self, nx, ny):
+        try:
+            self.controller.mc.position = (int(round(nx)), int(round(ny)))
+        except Exception:
+            pass
+
     def _sleep_ms(self, ms, stop_event=None):
         if ms <= 0: return
         se = stop_event or getattr(self.controller, '_stop_event', None)
@@ -975,24 +2628,1001 @@ class App:
         while slept < total:
             if se and se.is_set(): return
             chunk = min(0.02, total - slept)
-            time.sleep(chunk); slept += chunk
+            self.clock.sleep(chunk); slept += chunk
 
     def _cleanup_inputs(self):
-        for k in list(self._pressed_keys):
-            try: self.controller.kc.release(k)
-            except: pass
-            self._pressed_keys.discard(k)
-        for b in list(self._pressed_buttons):
-            try: self.controller.mc.release(b)
-            except: pass
-            self._pressed_buttons.discard(b)
+        with self.controller.batch():
+            for k in list(self._pressed_keys):
+                try: self.controller.kc.release(k)
+                except: pass
+                self._pressed_keys.discard(k)
+            for b in list(self._pressed_buttons):
+                try: self.controller.mc.release(b)
+                except: pass
+                self._pressed_buttons.discard(b)
 
-if __name__ == '__main__':
-    root = tk.Tk()
-    app = App(root)
-    try:
-        root.mainloop()
-    except KeyboardInterrupt:
-        pass
-    finally:
-        app.quit()
+class App(Engine):
+    def __init__(self, master, controller=None):
+        self.master = master
+        master.title('Auto Input Controller — Chant + Ribbon')
+        Engine.__init__(self, controller)
+        self.style = ttk.Style(master)
+        try:
+            self.style.theme_use('clam')
+        except Exception:
+            pass
+        master.configure(bg='#2b2b2b')
+        self.style.configure('.', background='#2b2b2b', foreground='#e6e6e6', font=('Segoe UI', 10), relief='flat')
+        self.style.configure('TFrame', background='#2b2b2b')
+        self.style.configure('TLabelFrame', background='#2b2b2b', foreground='#e6e6e6')
+        self.style.configure('TLabel', background='#2b2b2b', foreground='#e6e6e6')
+        self.style.configure('TEntry', fieldbackground='#3a3a3a', background='#3a3a3a', foreground='#ffffff')
+        self.style.configure('TButton', background='#444444', foreground='#ffffff')
+        self.style.map('TButton', background=[('active', '#555555'), ('pressed', '#333333')])
+        pad = {'padx': 6, 'pady': 6}
+        notebook = ttk.Notebook(master)
+        notebook.grid(row=0, column=0, sticky='nsew', padx=6, pady=6)
+        tab_home = ttk.Frame(notebook)
+        tab_kb = ttk.Frame(notebook)
+        tab_mouse = ttk.Frame(notebook)
+        notebook.add(tab_home, text='Home')
+        notebook.add(tab_kb, text='Keyboard')
+        notebook.add(tab_mouse, text='Mouse')
+        master.grid_rowconfigure(0, weight=1)
+        master.grid_columnconfigure(0, weight=1)
+        tab_home.grid_columnconfigure(0, weight=1)
+        tab_kb.grid_columnconfigure(0, weight=1)
+        tab_mouse.grid_columnconfigure(0, weight=1)
+        hk_frame = ttk.LabelFrame(tab_home, text='Hotkey')
+        hk_frame.grid(row=0, column=0, sticky='ew', **pad)
+        hk_frame.columnconfigure(1, weight=1)
+        self.hotkey_str = StringVar(value='ctrl+shift+m')
+        ttk.Label(hk_frame, text='Toggle Hotkey (example: ctrl+shift+m)').grid(row=0, column=0, sticky='w')
+        ttk.Entry(hk_frame, textvariable=self.hotkey_str).grid(row=0, column=1, sticky='ew')
+        ttk.Button(hk_frame, text='Register Hotkey', command=self.register_hotkey).grid(row=0, column=2, sticky='e')
+        self.hotkey_pauses = IntVar(value=0)
+        ttk.Checkbutton(hk_frame, text='Hotkey pauses/resumes instead of stopping', variable=self.hotkey_pauses).grid(row=1, column=0, columnspan=3, sticky='w')
+        global_frame = ttk.LabelFrame(tab_home, text='Global Timing')
+        global_frame.grid(row=1, column=0, sticky='ew', **pad)
+        global_frame.columnconfigure(1, weight=1)
+        ttk.Label(global_frame, text='Cycle delay fixed (ms)').grid(row=0, column=0, sticky='w')
+        self.global_fixed_ms = StringVar(value='100')
+        ttk.Entry(global_frame, textvariable=self.global_fixed_ms, width=12).grid(row=0, column=1, sticky='w')
+        ttk.Label(global_frame, text='Cycle jitter min,max (ms)').grid(row=0, column=2, sticky='w')
+        self.global_jitter = StringVar(value='0,0')
+        ttk.Entry(global_frame, textvariable=self.global_jitter, width=14).grid(row=0, column=3, sticky='w')
+        self.low_latency = IntVar(value=0)
+        ttk.Checkbutton(global_frame, text='Low-latency mode (freeze GC, collect only between cycles)', variable=self.low_latency).grid(row=1, column=0, columnspan=4, sticky='w')
+        chant_frame = ttk.LabelFrame(tab_home, text='Chant (combined sequence — steps separated by ;, parallel by ||)')
+        chant_frame.grid(row=2, column=0, sticky='ew', **pad)
+        chant_frame.columnconfigure(0, weight=1)
+        self.chant_text = StringVar(value='')
+        self.chant_edit = tk.Text(chant_frame, height=3, wrap='char', undo=True, relief='flat', font=('Consolas', 10),
+                                  bg='#3a3a3a', fg='#ffffff', insertbackground='#ffffff')
+        self.chant_edit.grid(row=0, column=0, padx=4, pady=4, sticky='ew')
+        self.chant_edit.tag_configure('chant_error', foreground='#ff6b6b', underline=True)
+        self.chant_edit.tag_configure('chant_warning', foreground='#e0c060', underline=True)
+        self.chant_edit.bind('<<Modified>>', self._on_chant_modified)
+        self._chant_validator = ChantValidator()
+        self._chant_after = None
+        self.chant_status = ttk.Label(chant_frame, text='')
+        self.chant_status.grid(row=1, column=0, sticky='w')
+        chant_help = (
+            "Example: mouse|hold=14000|button=left || a|hold=14000 ; mouse|rel=180|dist=50|move=1000; mouse|hold=14000|button=left || a|hold=14000 ; stop"
+        )
+        ttk.Label(chant_frame, text=chant_help).grid(row=2, column=0, sticky='w')
+        ctrl_frame = ttk.Frame(tab_home)
+        ctrl_frame.grid(row=3, column=0, sticky='ew', **pad)
+        ctrl_frame.columnconfigure(0, weight=1)
+        self.toggle_label = ttk.Label(ctrl_frame, text='State: OFF')
+        self.toggle_label.grid(row=0, column=0, sticky='w')
+        ttk.Button(ctrl_frame, text='Start', command=self.gui_start).grid(row=0, column=1, sticky='e')
+        ttk.Button(ctrl_frame, text='Pause/Resume', command=self.toggle_pause).grid(row=0, column=2, sticky='e')
+        ttk.Button(ctrl_frame, text='Stop', command=self.gui_stop).grid(row=0, column=3, sticky='e')
+        ttk.Button(ctrl_frame, text='Quit', command=self.quit).grid(row=0, column=4, sticky='e')
+        kb_frame = ttk.LabelFrame(tab_kb, text='Keyboard')
+        kb_frame.grid(row=0, column=0, sticky='ew', **pad)
+        kb_frame.columnconfigure(1, weight=1)
+        self.enable_kb = IntVar(value=1)
+        ttk.Checkbutton(kb_frame, text='Enable Keyboard', variable=self.enable_kb).grid(row=0, column=0, sticky='w')
+        ttk.Label(kb_frame, text='Sequence (comma-separated)').grid(row=1, column=0, sticky='w')
+        self.kb_sequence = StringVar(value='w+d,w,a,s|repeat=2')
+        ttk.Entry(kb_frame, textvariable=self.kb_sequence).grid(row=1, column=1, columnspan=3, sticky='ew')
+        ttk.Label(kb_frame, text='Mode').grid(row=2, column=0, sticky='w')
+        self.kb_mode = StringVar(value='single')
+        ttk.OptionMenu(kb_frame, self.kb_mode, 'single', 'single', 'hold', 'cps', 'rate').grid(row=2, column=1, sticky='w')
+        ttk.Label(kb_frame, text='Param (hold ms, cps range min,max, or rate cps[,max])').grid(row=2, column=2, sticky='w')
+        self.kb_param = StringVar(value='100')
+        ttk.Entry(kb_frame, textvariable=self.kb_param, width=16).grid(row=2, column=3, sticky='w')
+        ttk.Label(kb_frame, text='Per-action delay (fixed ms)').grid(row=3, column=0, sticky='w')
+        self.kb_delay_fixed = StringVar(value='50')
+        ttk.Entry(kb_frame, textvariable=self.kb_delay_fixed, width=12).grid(row=3, column=1, sticky='w')
+        ttk.Label(kb_frame, text='Per-action jitter min,max (ms)').grid(row=3, column=2, sticky='w')
+        self.kb_jitter = StringVar(value='0,20')
+        ttk.Entry(kb_frame, textvariable=self.kb_jitter, width=14).grid(row=3, column=3, sticky='w')
+        ttk.Label(kb_frame, text='Switch delay between pairs (ms)').grid(row=4, column=0, sticky='w')
+        self.pair_switch_ms = StringVar(value='30')
+        ttk.Entry(kb_frame, textvariable=self.pair_switch_ms, width=12).grid(row=4, column=1, sticky='w')
+        mouse_frame = ttk.LabelFrame(tab_mouse, text='Mouse')
+        mouse_frame.grid(row=0, column=0, sticky='ew', **pad)
+        mouse_frame.columnconfigure(1, weight=1)
+        self.enable_mouse = IntVar(value=1)
+        ttk.Checkbutton(mouse_frame, text='Enable Mouse', variable=self.enable_mouse).grid(row=0, column=0, sticky='w')
+        ttk.Label(mouse_frame, text='Mode').grid(row=1, column=0, sticky='w')
+        self.mouse_mode = StringVar(value='single')
+        ttk.OptionMenu(mouse_frame, self.mouse_mode, 'single', 'single', 'hold', 'cps', 'move', 'rate').grid(row=1, column=1, sticky='w')
+        ttk.Label(mouse_frame, text='Button').grid(row=1, column=2, sticky='w')
+        self.mouse_button = StringVar(value='left')
+        ttk.OptionMenu(mouse_frame, self.mouse_button, 'left', 'left', 'right').grid(row=1, column=3, sticky='w')
+        ttk.Label(mouse_frame, text='Position (x,y) or blank').grid(row=2, column=0, sticky='w')
+        self.mouse_pos = StringVar(value='')
+        ttk.Entry(mouse_frame, textvariable=self.mouse_pos, width=16).grid(row=2, column=1, sticky='w')
+        ttk.Label(mouse_frame, text='Offset jitter px').grid(row=2, column=2, sticky='w')
+        self.mouse_jitter_px = StringVar(value='5')
+        ttk.Entry(mouse_frame, textvariable=self.mouse_jitter_px, width=8).grid(row=2, column=3, sticky='w')
+        ttk.Label(mouse_frame, text='Mouse param (hold ms, cps min,max, or rate cps[,max])').grid(row=3, column=0, sticky='w')
+        self.mouse_param = StringVar(value='100')
+        ttk.Entry(mouse_frame, textvariable=self.mouse_param, width=16).grid(row=3, column=1, sticky='w')
+        ttk.Label(mouse_frame, text='Per-action delay (fixed ms)').grid(row=4, column=0, sticky='w')
+        self.mouse_delay_fixed = StringVar(value='50')
+        ttk.Entry(mouse_frame, textvariable=self.mouse_delay_fixed, width=12).grid(row=4, column=1, sticky='w')
+        ttk.Label(mouse_frame, text='Per-action jitter min,max (ms)').grid(row=4, column=2, sticky='w')
+        self.mouse_jitter = StringVar(value='0,20')
+        ttk.Entry(mouse_frame, textvariable=self.mouse_jitter, width=14).grid(row=4, column=3, sticky='w')
+        move_frame = ttk.LabelFrame(mouse_frame, text='Movement / Ease Options')
+        move_frame.grid(row=5, column=0, columnspan=4, sticky='ew', pady=(6,0))
+        move_frame.columnconfigure(1, weight=1)
+        ttk.Label(move_frame, text='Move style').grid(row=0, column=0, sticky='w')
+        self.move_style = StringVar(value='ease-out')
+        ttk.OptionMenu(move_frame, self.move_style, 'ease-out', 'linear', 'ease-out', 'ease-out+overshoot').grid(row=0, column=1, sticky='w')
+        ttk.Label(move_frame, text='Duration (ms)').grid(row=0, column=2, sticky='w')
+        self.move_dur = StringVar(value='200')
+        ttk.Entry(move_frame, textvariable=self.move_dur, width=12).grid(row=0, column=3, sticky='w')
+        ttk.Label(move_frame, text='Overshoot px min,max').grid(row=1, column=0, sticky='w')
+        self.overshoot_px = StringVar(value='8,20')
+        ttk.Entry(move_frame, textvariable=self.overshoot_px, width=16).grid(row=1, column=1, sticky='w')
+        ttk.Label(move_frame, text='Axis-offset px min,max (applied on change)').grid(row=1, column=2, sticky='w')
+        self.axis_offset_px = StringVar(value='0,6')
+        ttk.Entry(move_frame, textvariable=self.axis_offset_px, width=16).grid(row=1, column=3, sticky='w')
+        timing_frame = ttk.LabelFrame(tab_home, text='Inter-action Timing')
+        timing_frame.grid(row=4, column=0, sticky='ew', **pad)
+        timing_frame.columnconfigure(1, weight=1)
+        ttk.Label(timing_frame, text='Inter-action fixed (ms)').grid(row=0, column=0, sticky='w')
+        self.action_fixed = StringVar(value='20')
+        ttk.Entry(timing_frame, textvariable=self.action_fixed, width=12).grid(row=0, column=1, sticky='w')
+        ttk.Label(timing_frame, text='Inter-action jitter min,max (ms)').grid(row=0, column=2, sticky='w')
+        self.action_jitter = StringVar(value='0,10')
+        ttk.Entry(timing_frame, textvariable=self.action_jitter, width=14).grid(row=0, column=3, sticky='w')
+        help_frame = ttk.LabelFrame(master, text='Sequence syntax examples')
+        help_frame.grid(row=6, column=0, sticky='ew', **pad)
+        help_frame.columnconfigure(0, weight=1)
+        help_text = (
+            "Chant example:\n"
+            "mouse|hold=14000|button=left || a|hold=14000 ; mouse|rel=180|dist=50|move=1000; mouse|hold=14000|button=left || a|hold=14000 ; stop\n"
+            "If Chant is non-empty it overrides separate KB/Mouse fields. This example works for Hypixel Skyblock farms, mining 2 rows at 175 speed.\n"
+            "Timeline: |@+500 delays an action 500 ms into its step; |lane=name runs it on a lane that keeps going past the step barrier; sync (or sync=name) waits for lanes.\n"
+            "Typing: type=\"Hello, world\\n\"|cps=40|human=20 types a string at 40 chars/s with +/-20% humanized spacing."
+        )
+        ttk.Label(help_frame, text=help_text).grid(row=0, column=0, sticky='w')
+        self.hotkey_listener = None
+        self.register_hotkey()
+
+    def _on_chant_modified(self, event=None):
+        if not self.chant_edit.edit_modified():
+            return
+        self.chant_edit.edit_modified(False)
+        self.chant_text.set(self.chant_edit.get('1.0', 'end-1c'))
+        if self._chant_after is not None:
+            self.master.after_cancel(self._chant_after)
+        self._chant_after = self.master.after(150, self._validate_chant)
+
+    def _validate_chant(self):
+        self._chant_after = None
+        raw = self.chant_text.get()
+        try: move_dur = int(self.move_dur.get())
+        except: move_dur = 200
+        try: global_ms = int(self.global_fixed_ms.get() or 0)
+        except: global_ms = 0
+        steps, diags, est_ms = self._chant_validator.validate(raw, move_dur, global_ms)
+        ed = self.chant_edit
+        ed.tag_remove('chant_error', '1.0', 'end')
+        ed.tag_remove('chant_warning', '1.0', 'end')
+        for start, end, sev, msg in diags[:200]:
+            ed.tag_add('chant_' + sev, '1.0+%dc' % start, '1.0+%dc' % max(end, start + 1))
+        if not raw.strip():
+            self.chant_status.config(text='')
+            return
+        summary = '%d steps, ~%.1f s/cycle' % (len(steps), est_ms / 1000.0)
+        errors = [d for d in diags if d[2] == 'error']
+        if errors:
+            summary = '%d error(s): %s | %s' % (len(errors), errors[0][3], summary)
+        elif diags:
+            summary = '%d warning(s): %s | %s' % (len(diags), diags[0][3], summary)
+        self.chant_status.config(text=summary)
+
+    def hotkey_to_pynput(self, hk: str):
+        parts = [p.strip().lower() for p in hk.split('+') if p.strip()]
+        if not parts: return None
+        pynput_parts = []
+        for p in parts:
+            if p in ('ctrl', 'control'): pynput_parts.append('<ctrl>')
+            elif p in ('shift',): pynput_parts.append('<shift>')
+            elif p in ('alt',): pynput_parts.append('<alt>')
+            elif p in ('cmd', 'super', 'win'): pynput_parts.append('<cmd>')
+            else: pynput_parts.append(p)
+        return '+'.join(pynput_parts)
+
+    def register_hotkey(self):
+        hk = self.hotkey_str.get()
+        if self.hotkey_listener:
+            try: self.hotkey_listener.stop()
+            except: pass
+            self.hotkey_listener = None
+        try:
+            pynput_hk = self.hotkey_to_pynput(hk)
+            if not pynput_hk:
+                messagebox.showerror('Hotkey error', 'Invalid hotkey')
+                return
+            mapping = {pynput_hk: self._on_hotkey}
+            self.hotkey_listener = keyboard.GlobalHotKeys(mapping)
+            self.hotkey_listener.start()
+            messagebox.showinfo('Hotkey', f'Registered hotkey: {hk}')
+        except Exception as e:
+            messagebox.showerror('Hotkey error', f'Could not register hotkey: {e}')
+
+    def gui_start(self):
+        if self.controller.running:
+            messagebox.showinfo('Already running', 'Automation already running')
+            return
+        self.toggle_running()
+
+    def gui_stop(self):
+        if not self.controller.running:
+            messagebox.showinfo('Not running', 'Automation not running')
+            return
+        self.toggle_running()
+
+    def toggle_running(self):
+        if not self.controller.running:
+            self.toggle_label.config(text='State: ON')
+            self.start()
+        else:
+            self.stop()
+            self.toggle_label.config(text='State: OFF')
+
+    def _on_hotkey(self):
+        if self.hotkey_pauses.get() and self.controller.running:
+            self.toggle_pause()
+        else:
+            self.toggle_running()
+
+    def toggle_pause(self):
+        if not self.controller.running:
+            return
+        if self.paused:
+            self.resume_async()
+            self.toggle_label.config(text='State: ON')
+        else:
+            self.pause()
+            self.toggle_label.config(text='State: PAUSED')
+
+    def quit(self):
+        try:
+            if self.hotkey_listener: self.hotkey_listener.stop()
+        except: pass
+        self.stop()
+        self.master.quit()
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    # Events are queued per subscriber and written by the subscriber's own
+    # thread, so a client that stops reading can never stall the engine.
+    event_queue_max = 256
+
+    def setup(self):
+        super().setup()
+        self.wlock = threading.Lock()
+        self.events = None
+
+    def handle(self):
+        service = self.server.smkb_service
+        try:
+            for line in self.rfile:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    msg = json.loads(line)
+                    if not isinstance(msg, dict):
+                        raise ValueError('expected a JSON object')
+                except ValueError as e:
+                    self.send({'ok': False, 'error': 'bad request: %s' % e})
+                    continue
+                reply = service.handle(msg, self)
+                if 'id' in msg:
+                    reply['id'] = msg['id']
+                self.send(reply)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            service.disconnect(self)
+
+    def send(self, obj):
+        data = (json.dumps(obj, separators=(',', ':')) + '\n').encode('utf-8')
+        with self.wlock:
+            self.wfile.write(data)
+
+    def subscribe(self):
+        if self.events is None:
+            self.events = queue.Queue(self.event_queue_max)
+            threading.Thread(target=self._write_events, args=(self.events,), daemon=True).start()
+
+    def unsubscribe(self):
+        q, self.events = self.events, None
+        if q is None:
+            return
+        with q.mutex:
+            q.queue.clear()
+        q.put_nowait(None)
+
+    def push(self, obj):
+        # Never blocks; False means the subscriber has fallen too far behind.
+        q = self.events
+        if q is None:
+            return True
+        try:
+            q.put_nowait(obj)
+            return True
+        except queue.Full:
+            return False
+
+    def kick(self):
+        # Unblocks a stalled write and ends the read loop, which disconnects.
+        try: self.request.shutdown(socket.SHUT_RDWR)
+        except OSError: pass
+
+    def _write_events(self, q):
+        while True:
+            obj = q.get()
+            if obj is None:
+                return
+            try:
+                self.send(obj)
+            except (OSError, ValueError):
+                return
+
+class _ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def _bind_unix(path, service):
+    if os.path.exists(path):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                probe.connect(path)
+            raise OSError('%s: another server is already listening' % path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+    server = _ControlServer(path, _ControlHandler)
+    server.smkb_service = service
+    os.chmod(path, 0o600)
+    return server
+
+_M_SUBS_DROPPED = METRICS.counter('smkb_control_subscribers_dropped_total', 'Event subscribers disconnected for falling behind')
+
+class ControlDaemon:
+    def __init__(self, engine, path):
+        self.engine = engine
+        self.path = path
+        self._subs = set()
+        self._subs_lock = threading.Lock()
+        self._server = None
+        engine.add_listener(self._notify)
+
+    def _notify(self, event, data):
+        with self._subs_lock:
+            subs = list(self._subs)
+        if not subs:
+            return
+        msg = dict(data, event=event, running=self.engine.controller.running and event != 'stopped')
+        for h in subs:
+            if not h.push(msg):
+                _M_SUBS_DROPPED.inc()
+                self.unsubscribe(h)
+                h.kick()
+
+    def unsubscribe(self, handler):
+        with self._subs_lock:
+            self._subs.discard(handler)
+        handler.unsubscribe()
+
+    disconnect = unsubscribe
+
+    def handle(self, msg, handler=None):
+        cmd = msg.get('cmd')
+        eng = self.engine
+        try:
+            if cmd == 'ping':
+                return {'ok': True}
+            if cmd == 'status':
+                return dict(eng.status(), ok=True)
+            if cmd == 'stats':
+                return dict(eng.stats(), ok=True)
+            if cmd == 'start':
+                return {'ok': True, 'started': eng.start()}
+            if cmd == 'stop':
+                return {'ok': True, 'stopped': eng.stop()}
+            if cmd == 'pause':
+                return {'ok': True, 'paused': eng.pause()}
+            if cmd == 'resume':
+                # With an arbiter the slot can take a while; never hold the client.
+                if eng.arbiter:
+                    started = eng.resume_async()
+                    return {'ok': True, 'resumed': started, 'state': 'resuming' if started else eng.state()}
+                resumed = eng.resume()
+                return {'ok': True, 'resumed': resumed, 'state': eng.state()}
+            if cmd == 'load':
+                return self._load(msg)
+            if cmd == 'subscribe':
+                handler.subscribe()
+                with self._subs_lock:
+                    self._subs.add(handler)
+                return {'ok': True}
+            if cmd == 'unsubscribe':
+                self.unsubscribe(handler)
+                return {'ok': True}
+            if cmd == 'shutdown':
+                eng.stop()
+                threading.Thread(target=self._server.shutdown, daemon=True).start()
+                return {'ok': True}
+        except (ValueError, OSError) as e:
+            return {'ok': False, 'error': str(e)}
+        except Exception as e:
+            return {'ok': False, 'error': '%s: %s' % (type(e).__name__, e)}
+        return {'ok': False, 'error': 'unknown command: %r' % (cmd,)}
+
+    def _load(self, msg):
+        eng = self.engine
+        text = msg.get('chant')
+        compiled = None
+        path = msg.get('file')
+        for key, val in (('chant', text), ('file', path)):
+            if val is not None and not isinstance(val, str):
+                raise ValueError('%s must be a string' % key)
+        # Validate settings up front, so a bad request never stops a running macro.
+        settings = Engine.check_settings(msg['settings']) if msg.get('settings') is not None else None
+        if path:
+            if path.endswith('.json'):
+                compiled = load_compiled_chant(path)
+                text = ''
+            else:
+                with open(path, encoding='utf-8') as f:
+                    text = f.read()
+        if text is None and compiled is None:
+            raise ValueError("load needs 'chant' or 'file'")
+        diags = []
+        if compiled is None:
+            diags = lint_chant(text)['diagnostics']
+            if any(d[2] == 'error' for d in diags) and not msg.get('force'):
+                return {'ok': False, 'error': 'chant has errors', 'diagnostics': diags}
+        was_running = eng.stop()
+        if settings:
+            eng.apply_settings(settings)
+        eng.load_chant(text, compiled)
+        if was_running or msg.get('start'):
+            eng.start()
+        return dict(eng.status(), ok=True, diagnostics=diags)
+
+    def serve_forever(self):
+        self._server = _bind_unix(self.path, self)
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            self.engine.stop()
+            try: os.unlink(self.path)
+            except OSError: pass
+
+_M_ARBITER_WAIT = METRICS.histogram('smkb_arbiter_wait_seconds', 'Time spent waiting for an input slot from the arbiter')
+
+class InputArbiter:
+    def __init__(self, slice_ms=0, aging_ms=5000, grace_ms=2000):
+        self.slice_ms = slice_ms
+        self.aging_ms = max(1, aging_ms)
+        self.grace_ms = max(0, grace_ms)
+        self._cv = threading.Condition()
+        self._owner = None
+        self._grant_t = 0.0
+        self._lease_end = 0.0
+        self._waiting = []
+        self._seq = 0
+        self._names = {}
+        self.instances = {}
+        self._server = None
+
+    def _rank(self, req, now):
+        age_ms = (now - req['t0']) * 1000.0
+        return (-(req['priority'] + age_ms / self.aging_ms), req['est_ms'], req['seq'])
+
+    def _grantable(self, req):
+        now = time.perf_counter()
+        if self._owner is not None:
+            if now < self._lease_end:
+                return False
+            # The owner went quiet past its estimate plus grace: take the slot back.
+            name = self._names.get(self._owner, (None,))[0]
+            if name in self.instances:
+                self.instances[name]['revoked'] += 1
+            self._release(self._owner)
+        return min(self._waiting, key=lambda r: self._rank(r, now)) is req
+
+    def _lease(self, est_ms):
+        self._lease_end = time.perf_counter() + ms_to_sec(max(self.slice_ms, est_ms) + self.grace_ms)
+
+    @staticmethod
+    def _cancelled(handler):
+        # The handler thread is parked in acquire, so look at the socket
+        # directly: EOF, or any line (normally {"cmd":"cancel"}), ends the wait.
+        try:
+            if not select.select([handler.connection], [], [], 0)[0]:
+                return False
+            handler.rfile.readline()
+        except (OSError, ValueError):
+            pass
+        return True
+
+    def handle(self, msg, handler=None):
+        cmd = msg.get('cmd')
+        if cmd == 'register':
+            name = str(msg.get('name') or 'instance-%d' % id(handler))
+            try: priority = int(msg.get('priority', 0))
+            except (TypeError, ValueError): return {'ok': False, 'error': 'priority must be an integer'}
+            with self._cv:
+                self._names[handler] = (name, priority)
+                self.instances.setdefault(name, {'priority': priority, 'grants': 0, 'wait_ms_total': 0.0, 'wait_ms_max': 0.0, 'held_ms_total': 0.0, 'revoked': 0, 'cancelled': 0, 'connected': True})
+                self.instances[name].update(priority=priority, connected=True)
+            return {'ok': True, 'name': name, 'slice_ms': self.slice_ms}
+        if cmd == 'acquire':
+            if handler not in self._names:
+                return {'ok': False, 'error': 'register first'}
+            name, priority = self._names[handler]
+            try: est_ms = max(0.0, float(msg.get('est_ms', 0)))
+            except (TypeError, ValueError): est_ms = 0.0
+            with self._cv:
+                self._seq += 1
+                req = {'priority': priority, 'est_ms': est_ms, 'seq': self._seq, 't0': time.perf_counter()}
+                self._waiting.append(req)
+                while not self._grantable(req):
+                    if handler is not None and self._cancelled(handler):
+                        self._waiting.remove(req)
+                        self.instances[name]['cancelled'] += 1
+                        self._cv.notify_all()
+                        return {'ok': True, 'granted': False, 'cancelled': True}
+                    self._cv.wait(0.25)
+                self._waiting.remove(req)
+                self._owner = handler
+                self._grant_t = time.perf_counter()
+                self._lease(est_ms)
+                wait_ms = (self._grant_t - req['t0']) * 1000.0
+                st = self.instances[name]
+                st['grants'] += 1
+                st['wait_ms_total'] += wait_ms
+                st['wait_ms_max'] = max(st['wait_ms_max'], wait_ms)
+            return {'ok': True, 'granted': True, 'wait_ms': wait_ms, 'slice_ms': max(self.slice_ms, est_ms)}
+        if cmd == 'renew':
+            # An owner whose lanes are still running extends its lease in place.
+            try: est_ms = max(0.0, float(msg.get('est_ms', 0)))
+            except (TypeError, ValueError): est_ms = 0.0
+            with self._cv:
+                if self._owner is not handler:
+                    return {'ok': True, 'granted': False}
+                self._lease(est_ms)
+            return {'ok': True, 'granted': True, 'slice_ms': max(self.slice_ms, est_ms)}
+        if cmd == 'release':
+            self._release(handler)
+            return {'ok': True}
+        if cmd == 'status':
+            with self._cv:
+                owner = self._names.get(self._owner, (None,))[0]
+                inst = {n: dict(st, wait_ms_avg=st['wait_ms_total'] / st['grants'] if st['grants'] else 0.0) for n, st in self.instances.items()}
+                return {'ok': True, 'owner': owner, 'waiting': len(self._waiting), 'instances': inst}
+        if cmd == 'ping':
+            return {'ok': True}
+        return {'ok': False, 'error': 'unknown command: %r' % (cmd,)}
+
+    def _release(self, handler):
+        with self._cv:
+            if self._owner is handler:
+                self._owner = None
+                name = self._names.get(handler, (None,))[0]
+                if name in self.instances:
+                    self.instances[name]['held_ms_total'] += (time.perf_counter() - self._grant_t) * 1000.0
+                self._cv.notify_all()
+
+    def disconnect(self, handler):
+        self._release(handler)
+        with self._cv:
+            name = self._names.pop(handler, (None,))[0]
+            if name in self.instances and name not in (n for n, _ in self._names.values()):
+                self.instances[name]['connected'] = False
+
+    def serve_forever(self, path):
+        self._server = _bind_unix(path, self)
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            try: os.unlink(path)
+            except OSError: pass
+
+class ArbiterClient:
+    def __init__(self, path, name, priority=0):
+        self.path = path
+        self.name = name
+        self.priority = priority
+        self.holding = False
+        self._slice_end = 0.0
+        self._sock = None
+        self._buf = b''
+        self._warned = False
+        # pause()/resume() run on other threads than the chant loop.
+        self._lock = threading.RLock()
+
+    def _close(self):
+        if self._sock is not None:
+            try: self._sock.close()
+            except OSError: pass
+        self._sock = None
+        self._buf = b''
+        self.holding = False
+
+    def _call(self, msg, stop_event=None):
+        try:
+            if self._sock is None:
+                self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._sock.settimeout(0.1)
+                self._sock.connect(self.path)
+                self._warned = False
+                if self._call({'cmd': 'register', 'name': self.name, 'priority': self.priority}) is None:
+                    return None
+            self._sock.sendall((json.dumps(msg) + '\n').encode('utf-8'))
+            deadline = None
+            while b'\n' not in self._buf:
+                if deadline is None and stop_event is not None and stop_event.is_set():
+                    # Withdraw the request; the reply says whether it was granted first.
+                    self._sock.sendall(b'{"cmd":"cancel"}\n')
+                    deadline = time.perf_counter() + 1.0
+                if deadline is not None and time.perf_counter() > deadline:
+                    self._close()
+                    return None
+                try:
+                    chunk = self._sock.recv(4096)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    raise ConnectionError('arbiter closed the connection')
+                self._buf += chunk
+            line, self._buf = self._buf.split(b'\n', 1)
+            return json.loads(line)
+        except (OSError, ValueError) as e:
+            if not self._warned:
+                print('Input arbiter unavailable, running unarbitrated:', e)
+                self._warned = True
+            self._close()
+            return None
+
+    def acquire(self, est_ms, stop_event=None, busy=False):
+        # busy: lanes from earlier steps are still sending input, so the slot
+        # is kept past the slice rather than handed over mid-hold.
+        with self._lock:
+            if self.holding:
+                now = time.perf_counter()
+                if now < self._slice_end:
+                    return 0.0
+                if busy:
+                    reply = self._call({'cmd': 'renew', 'est_ms': est_ms})
+                    if reply is None:
+                        return None
+                    if reply.get('granted'):
+                        self._slice_end = now + ms_to_sec(reply.get('slice_ms', 0))
+                        return 0.0
+                    self.holding = False
+                else:
+                    self.release(force=True)
+            t0 = time.perf_counter()
+            reply = self._call({'cmd': 'acquire', 'est_ms': est_ms}, stop_event)
+            if not reply or not reply.get('granted'):
+                return None
+            now = time.perf_counter()
+            self.holding = True
+            self._slice_end = now + ms_to_sec(reply.get('slice_ms', 0))
+            _M_ARBITER_WAIT.observe(now - t0)
+            return now - t0
+
+    def release(self, force=False):
+        if not self.holding:
+            return
+        with self._lock:
+            if not self.holding:
+                return
+            if not force and time.perf_counter() < self._slice_end:
+                return
+            self.holding = False
+            self._call({'cmd': 'release'})
+
+def run_arbiter(path, slice_ms, aging_ms, grace_ms=2000):
+    print('SMKB input arbiter listening on', path)
+    try:
+        InputArbiter(slice_ms, aging_ms, grace_ms).serve_forever(path)
+    except KeyboardInterrupt:
+        pass
+
+def send_command(path, msg, timeout=5.0):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall((json.dumps(msg) + '\n').encode('utf-8'))
+        buf = b''
+        while not buf.endswith(b'\n'):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            buf += chunk
+    return json.loads(buf)
+
+def run_ctl(path, cmd, args):
+    msg = {'cmd': cmd}
+    if cmd == 'load':
+        if not args:
+            print('usage: --ctl SOCKET load FILE|CHANT [--start]')
+            return 2
+        src = args[0]
+        if os.path.exists(src):
+            msg['file'] = os.path.abspath(src)
+        else:
+            msg['chant'] = src
+        msg['start'] = '--start' in args[1:]
+    if cmd == 'watch':
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+            sock.sendall(b'{"cmd":"subscribe"}\n')
+            try:
+                for line in sock.makefile('r', encoding='utf-8'):
+                    print(line.rstrip(), flush=True)
+            except KeyboardInterrupt:
+                pass
+        return 0
+    try:
+        reply = send_command(path, msg)
+    except (OSError, ValueError) as e:
+        print('%s: %s' % (path, e), file=sys.stderr)
+        return 1
+    print(json.dumps(reply, indent=2))
+    return 0 if reply.get('ok') else 1
+
+def attach_arbiter(engine, args):
+    if args.arbiter_socket:
+        engine.arbiter = ArbiterClient(args.arbiter_socket, args.arbiter_name or 'smkb-%d' % os.getpid(), args.arbiter_priority)
+
+def configure_realtime(engine, args):
+    if args.low_latency:
+        engine.low_latency.set(1)
+    if args.rt_priority or args.cpu:
+        engine.controller.realtime = {'rt_priority': args.rt_priority, 'cpus': args.cpu}
+
+def _jitter_samples(seconds, period_ms, realtime, out):
+    def loop():
+        if realtime:
+            out['realtime'] = apply_realtime(**realtime)
+        period = period_ms / 1000.0
+        late = out['late']
+        deadline = time.perf_counter() + period
+        end = deadline + seconds
+        while deadline < end:
+            dt = deadline - time.perf_counter()
+            if dt > 0:
+                time.sleep(dt)
+            late.append(time.perf_counter() - deadline)
+            deadline += period
+    t = threading.Thread(target=loop, daemon=True)
+    t.start()
+    t.join()
+
+def _jitter_summary(late):
+    late = sorted(late)
+    if not late:
+        return 'no samples'
+    pick = lambda q: late[min(len(late) - 1, int(q * len(late)))] * 1000.0
+    return 'p50 %.3f ms  p99 %.3f ms  max %.3f ms  mean %.3f ms  (%d wakeups)' % (
+        pick(0.5), pick(0.99), late[-1] * 1000.0, sum(late) / len(late) * 1000.0, len(late))
+
+def run_jitter_bench(seconds, rt_priority, cpus, load=0, period_ms=5, out=sys.stdout):
+    import subprocess
+    hogs = []
+    for _ in range(max(0, load)):
+        p = subprocess.Popen([sys.executable, '-c', 'while True: pass'])
+        if cpus and hasattr(os, 'sched_setaffinity'):
+            try: os.sched_setaffinity(p.pid, cpus)
+            except OSError: pass
+        hogs.append(p)
+    try:
+        print('Wakeup lateness of a %d ms deadline loop over %.1f s, %d busy process(es):' % (period_ms, seconds, len(hogs)), file=out)
+        before = {'late': []}
+        _jitter_samples(seconds, period_ms, None, before)
+        print('  default   ', _jitter_summary(before['late']), file=out)
+        if not (rt_priority or cpus):
+            print('  (pass --rt-priority and/or --cpu to measure the realtime mode)', file=out)
+            return 0
+        after = {'late': []}
+        _jitter_samples(seconds, period_ms, {'rt_priority': rt_priority, 'cpus': cpus}, after)
+        rt = after['realtime']
+        label = '%s %s' % (rt['policy'] or 'default', '' if rt['priority'] is None else rt['priority'])
+        if rt['cpus']:
+            label += ' cpu %s' % ','.join(map(str, rt['cpus']))
+        print('  realtime  ', _jitter_summary(after['late']), ' [%s]' % label.strip(), file=out)
+        for err in rt['errors']:
+            print('  note:', err, file=out)
+        return 0
+    finally:
+        for p in hogs:
+            p.kill()
+            p.wait()
+
+def run_daemon(path, args):
+    engine = Engine(make_controller(args.backend))
+    attach_arbiter(engine, args)
+    configure_realtime(engine, args)
+    daemon = ControlDaemon(engine, path)
+    print('SMKB daemon listening on', path)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+def simulate_chant(chant, cycles=1, settings=None, rng=None, start_pos=(0, 0), max_virtual_s=86400.0):
+    clock = VirtualClock()
+    events = []
+    kb = SimKeyboard(clock, events)
+    ms = SimMouse(clock, events, start_pos)
+    eng = Engine(AutoController(kb, ms), clock=clock)
+    eng.rng = rng if rng is not None else random.Random(0)
+    if settings:
+        eng.apply_settings(settings)
+    if isinstance(chant, str):
+        eng.load_chant(chant)
+    else:
+        eng.load_chant('', compiled_steps=chant)
+    stop = threading.Event()
+    cycle_s = []
+    def on_event(event, data):
+        if event == 'cycle':
+            cycle_s.append(data['seconds'])
+            if len(cycle_s) >= cycles:
+                stop.set()
+    eng.add_listener(on_event)
+    finished = clock.run(eng._job, (stop,), stop_event=stop, until=max_virtual_s)
+    pos = ms.position
+    return {
+        'cycles': cycle_s,
+        'duration_s': clock.now(),
+        'events': events,
+        'final_position': pos,
+        'drift': (pos[0] - start_pos[0], pos[1] - start_pos[1]),
+        'finished': finished,
+        'errors': list(clock.errors),
+    }
+
+def _format_event(ev):
+    t, device, op, detail = ev
+    return '%10.3f  %-5s  %-7s  %s' % (t * 1000.0, device, op, detail)
+
+def run_simulation(src, cycles, settings, seed=None, timeline=False, out=sys.stdout):
+    chant = src
+    if os.path.exists(src):
+        with open(src, encoding='utf-8') as f:
+            chant = f.read()
+    res = simulate_chant(chant, cycles, settings, random.Random(seed))
+    lo = simulate_chant(chant, cycles, settings, _BoundRandom(False))
+    hi = simulate_chant(chant, cycles, settings, _BoundRandom(True))
+    if timeline:
+        print('      t_ms  dev    op       detail', file=out)
+        for ev in res['events']:
+            print(_format_event(ev), file=out)
+    for i, c in enumerate(res['cycles'], 1):
+        print('cycle %d: %.3f s' % (i, c), file=out)
+    if res['cycles']:
+        print('cycle duration: %.3f s mean (min %.3f s, max %.3f s under jitter ranges)' % (
+            sum(res['cycles']) / len(res['cycles']), min(lo['cycles'] or [0]), max(hi['cycles'] or [0])), file=out)
+    else:
+        print('run duration: %.3f s (min %.3f s, max %.3f s under jitter ranges)' % (
+            res['duration_s'], lo['duration_s'], hi['duration_s']), file=out)
+    print('cursor drift: %+d, %+d px (final %d, %d)' % (res['drift'] + res['final_position']), file=out)
+    print('%d input events, %.3f s simulated' % (len(res['events']), res['duration_s']), file=out)
+    if not res['finished'] or res['errors']:
+        print('simulation did not finish cleanly', file=out)
+        return 1
+    return 0
+
+def _parse_settings(pairs):
+    settings = {}
+    for pair in pairs or []:
+        k, sep, v = pair.partition('=')
+        if not sep:
+            raise SystemExit('--set expects key=value, got %r' % pair)
+        settings[k.strip()] = v.strip()
+    try:
+        return Engine.check_settings(settings)
+    except ValueError as e:
+        raise SystemExit('--set: %s' % e)
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description='SMKB — chant driven keyboard/mouse macro controller')
+    ap.add_argument('--metrics-port', type=int, default=None, help='serve Prometheus metrics on 127.0.0.1:PORT/metrics')
+    ap.add_argument('--metrics-file', default=None, help='periodically write Prometheus metrics to this file')
+    ap.add_argument('--metrics-interval', type=float, default=10.0, help='seconds between metrics file writes (default 10)')
+    ap.add_argument('--lint', nargs='+', metavar='PATH', help='validate chant files/directories and exit')
+    ap.add_argument('--jobs', type=int, default=None, help='worker processes for --lint (default: CPU count)')
+    ap.add_argument('--emit', metavar='DIR', default=None, help='with --lint, write compiled chants (JSON) into DIR')
+    ap.add_argument('--pattern', default='*.chant', help='file pattern used when --lint is given a directory (default *.chant)')
+    ap.add_argument('--daemon', metavar='SOCKET', default=None, help='run headless and accept JSON commands on a Unix socket')
+    ap.add_argument('--arbiter', metavar='SOCKET', default=None, help='run the shared input arbiter on a Unix socket')
+    ap.add_argument('--slice-ms', type=int, default=0, help='with --arbiter, minimum slot length an instance may keep between steps (default 0)')
+    ap.add_argument('--aging-ms', type=int, default=5000, help='with --arbiter, waiting time that raises a request by one priority level (default 5000)')
+    ap.add_argument('--lease-grace-ms', type=int, default=2000, help='with --arbiter, take the slot back from an owner that has not released or renewed this long after its estimate (default 2000)')
+    ap.add_argument('--arbiter-socket', metavar='SOCKET', default=None, help='take input slots from the arbiter listening on SOCKET')
+    ap.add_argument('--arbiter-name', default=None, help='instance name reported to the arbiter (default smkb-PID)')
+    ap.add_argument('--arbiter-priority', type=int, default=0, help='arbiter priority, higher is served first (default 0)')
+    ap.add_argument('--simulate', metavar='CHANT', default=None, help='run a chant (file or text) against a virtual clock and report timing')
+    ap.add_argument('--cycles', type=int, default=1, help='cycles to simulate (default 1)')
+    ap.add_argument('--seed', type=int, default=None, help='random seed for the simulated jitter')
+    ap.add_argument('--timeline', action='store_true', help='with --simulate, print every input event')
+    ap.add_argument('--set', action='append', metavar='KEY=VALUE', help='override an engine setting, e.g. --set global_fixed_ms=50')
+    ap.add_argument('--rt-priority', type=int, default=None, metavar='N', help='run the input thread under SCHED_FIFO at priority N (1-99); falls back to nice -10 without permission')
+    ap.add_argument('--cpu', type=parse_cpu_list, default=None, metavar='LIST', help='pin the input thread to these CPUs, e.g. 3 or 2,3 or 2-3')
+    ap.add_argument('--backend', choices=('pynput', 'xtest'), default='pynput', help='input backend; xtest injects events through libXtst directly on X11 (default pynput)')
+    ap.add_argument('--low-latency', action='store_true', help='freeze the GC at start and collect only between cycles')
+    ap.add_argument('--jitter-bench', type=float, default=None, metavar='SECONDS', help='measure wakeup jitter with and without --rt-priority/--cpu and exit')
+    ap.add_argument('--jitter-load', type=int, default=0, metavar='N', help='with --jitter-bench, run N busy processes (pinned to --cpu) as synthetic load')
+    ap.add_argument('--ctl', nargs=argparse.REMAINDER, metavar='SOCKET CMD', help='send CMD (load/start/stop/pause/resume/status/stats/watch/shutdown) to a daemon')
+    return ap.parse_args(argv)
+
+def start_metrics(args):
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    if args.metrics_file:
+        start_metrics_file_writer(args.metrics_file, args.metrics_interval)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.lint:
+        sys.exit(lint_paths(args.lint, jobs=args.jobs, emit_dir=args.emit, pattern=args.pattern))
+    if args.ctl:
+        if not args.ctl or len(args.ctl) < 2:
+            sys.exit('usage: --ctl SOCKET CMD [ARGS]')
+        sys.exit(run_ctl(args.ctl[0], args.ctl[1], args.ctl[2:]))
+    if args.simulate:
+        sys.exit(run_simulation(args.simulate, max(1, args.cycles), _parse_settings(args.set), args.seed, args.timeline))
+    if args.jitter_bench:
+        sys.exit(run_jitter_bench(args.jitter_bench, args.rt_priority, args.cpu, args.jitter_load))
+    if args.arbiter:
+        run_arbiter(args.arbiter, args.slice_ms, args.aging_ms, args.lease_grace_ms)
+        return
+    start_metrics(args)
+    if args.daemon:
+        run_daemon(args.daemon, args)
+        return
+    controller = make_controller(args.backend)
+    root = tk.Tk()
+    app = App(root, controller)
+    attach_arbiter(app, args)
+    configure_realtime(app, args)
+    try:
+        root.mainloop()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        app.quit()
+        if args.metrics_file:
+            try: write_metrics_file(args.metrics_file)
+            except Exception: pass
+
+if __name__ == '__main__':
+    main()
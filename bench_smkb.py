@@ -0,0 +1,284 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import SMKB
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+
+README_CHANT = 'mouse|hold=14000|button=left || a|hold=14000 ; mouse|rel=180|dist=50|move=1000; mouse|hold=14000|button=left || a|hold=14000 ; stop'
+STEP_VARIANTS = (
+    'mouse|hold=14000|button=left || a|hold=14000',
+    'mouse|rel=180|dist=50|move=1000',
+    'w+d|hold=200|repeat=2, s, ctrl+shift+f5',
+    'mouse(100,200)|move=300|@+50|lane=aim || space|hold=120',
+    'type="hi there, gg"|cps=40',
+)
+
+def make_chant(n_actions):
+    steps = []
+    count = 0
+    i = 0
+    while count < n_actions:
+        st = STEP_VARIANTS[i % len(STEP_VARIANTS)]
+        steps.append(st)
+        count += len(SMKB.parse_chant(st)[0])
+        i += 1
+    return ' ; '.join(steps)
+
+class _NullKeyboard:
+    def press(self, k): pass
+    def release(self, k): pass
+
+class _NullMouse:
+    def __init__(self):
+        self.position = (0, 0)
+    def press(self, b): pass
+    def release(self, b): pass
+    def click(self, b, count=1): pass
+
+class _NullClock(SMKB.RealClock):
+    spin_s = 0.0
+    @staticmethod
+    def sleep(dt):
+        pass
+
+def make_engine():
+    eng = SMKB.Engine(SMKB.AutoController(_NullKeyboard(), _NullMouse()), clock=_NullClock())
+    eng.rng = SMKB.random.Random(0)
+    return eng
+
+def build_cases():
+    cases = {}
+    for n, label in ((5, 'readme'), (100, '100'), (1000, '1k'), (5000, '5k')):
+        chant = README_CHANT if label == 'readme' else make_chant(n)
+        cases['parse_chant[%s]' % label] = (lambda c=chant: SMKB.parse_chant(c))
+    seq_short = 'w+d,w,a,s|repeat=2'
+    seq_long = ','.join(('w+d|hold=50', 'a', 's|repeat=3', 'ctrl+c', 'f5') * 200)
+    cases['parse_sequence[short]'] = lambda: SMKB.parse_sequence(seq_short)
+    cases['parse_sequence[1k]'] = lambda: SMKB.parse_sequence(seq_long)
+    names = ['a', 'Enter', 'shift', 'pagedown', 'f12', 'x', ' space ', 'nosuchkey', '', 'ctrl'] * 10
+    cases['parse_key_name[x100]'] = lambda: [SMKB.parse_key_name(n) for n in names]
+    mods = ['hold=14000', 'button=left', 'rel=180.5', 'dist=50', 'move=1000', 'repeat=3', 'bogus', 'lane=aim'] * 12
+    match = SMKB.MODIFIER_RE.match
+    cases['MODIFIER_RE.match[x96]'] = lambda: [match(m) for m in mods]
+    eng = make_engine()
+    for style in ('linear', 'ease-out', 'ease-out+overshoot', 'other'):
+        def move(style=style):
+            eng.rng.seed(0)
+            eng.controller.mc.position = (0, 0)
+            eng._last_mouse_target = None
+            eng._mouse_move_to((800, 450), 0, 2000, style, (8, 20), (0, 6))
+        cases['_mouse_move_to[%s]' % style] = move
+    def semicircle():
+        eng.rng.seed(0)
+        eng._mouse_move_semicircle((0, 0), (800, 450), 2000, 'ease-out')
+    cases['_mouse_move_semicircle'] = semicircle
+    held_keys = [chr(ord('a') + i % 26) + str(i) for i in range(500)]
+    held_buttons = list(SMKB.MouseButton)
+    def cleanup():
+        eng._pressed_keys.update(held_keys)
+        eng._pressed_buttons.update(held_buttons)
+        eng._cleanup_inputs()
+    cases['_cleanup_inputs[500]'] = cleanup
+    return cases
+
+def _calibration_work():
+    d = {}
+    for i in range(2000):
+        d[i & 63] = (i, str(i))
+    return sorted(d)
+
+def _loop_count(fn, min_time):
+    number = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - t0 >= min_time or number >= 1 << 20:
+            return number
+        number *= 2
+
+def _rate(fn, number):
+    t0 = time.perf_counter()
+    for _ in range(number):
+        fn()
+    return number / (time.perf_counter() - t0)
+
+def measure(fn, min_time=0.04, repeats=9):
+    # Every repeat is paired with a calibration run taken right before it, so
+    # a slow patch on a shared machine lands on both sides of the ratio. The
+    # median score (case rate / calibration rate) is what gets compared.
+    # Cyclic GC is off while timing (as timeit does), so a collection that
+    # depends on what ran before does not land on one case.
+    enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        number = _loop_count(fn, min_time)
+        cal_number = _loop_count(_calibration_work, min_time)
+        rates, cals, scores = [], [], []
+        for _ in range(repeats):
+            cal = _rate(_calibration_work, cal_number)
+            rate = _rate(fn, number)
+            rates.append(rate)
+            cals.append(cal)
+            scores.append(rate / cal)
+    finally:
+        if enabled:
+            gc.enable()
+    return statistics.median(rates), statistics.median(cals), statistics.median(scores)
+
+def measure_alloc(fn):
+    fn()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        fn()
+        return max(0, tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+
+def run(cases, name_filter=None):
+    results = {}
+    for name, fn in cases.items():
+        if name_filter and name_filter not in name:
+            continue
+        ops, cal, score = measure(fn)
+        results[name] = {'ops_per_s': ops, 'calibration': cal, 'score': score, 'peak_alloc_bytes': measure_alloc(fn)}
+    return results
+
+def compare(results, baseline, max_slowdown, max_alloc_growth, out=sys.stdout):
+    failed = []
+    print('%-36s %14s %14s %8s %12s %12s' % ('benchmark', 'ops/s', 'expected', 'ratio', 'peak B', 'base B'), file=out)
+    for name, res in sorted(results.items()):
+        base = baseline.get('results', {}).get(name)
+        if base is None or 'score' not in base:
+            print('%-36s %14.1f %14s %8s %12d %12s' % (name, res['ops_per_s'], '-', 'new', res['peak_alloc_bytes'], '-'), file=out)
+            continue
+        # The baseline score scaled by the calibration measured next to this case.
+        expected = base['score'] * res['calibration']
+        ratio = res['score'] / base['score']
+        alloc_limit = base['peak_alloc_bytes'] * (1.0 + max_alloc_growth) + 1024
+        flags = []
+        if ratio < 1.0 - max_slowdown:
+            flags.append('SLOWER')
+        if res['peak_alloc_bytes'] > alloc_limit:
+            flags.append('ALLOC')
+        if flags:
+            failed.append(name)
+        print('%-36s %14.1f %14.1f %8.2f %12d %12d %s' % (
+            name, res['ops_per_s'], expected, ratio, res['peak_alloc_bytes'], base['peak_alloc_bytes'], ' '.join(flags)), file=out)
+    return failed
+
+GC_CHANT = ('mouse|hold=140|button=left || a|hold=140 ; mouse|rel=180|dist=50|move=1000 ; w+d|hold=50|repeat=2, s ; '
+            'mouse(100,200)|move=300|@+50|lane=aim || space|hold=120 ; sync ; type="hi there"|cps=40')
+
+def gc_report(cycles, out=sys.stdout):
+    # Runs the same chant through the simulator with and without low-latency
+    # mode and reports where collections landed and what they cost.
+    print('GC behaviour over %d simulated cycles:' % cycles, file=out)
+    for mode in ('0', '1'):
+        pauses = []
+        started = [0.0]
+        def cb(phase, info):
+            if phase == 'start': started[0] = time.perf_counter()
+            else: pauses.append((info['generation'], time.perf_counter() - started[0]))
+        blocks = SMKB._M_CYCLE_BLOCKS
+        n0, s0 = blocks.count, blocks.sum
+        gc.callbacks.append(cb)
+        try:
+            res = SMKB.simulate_chant(GC_CHANT, cycles, {'low_latency': mode})
+        finally:
+            gc.callbacks.remove(cb)
+        per_cycle = (blocks.sum - s0) / max(1, blocks.count - n0)
+        gens = [sum(1 for g, _ in pauses if g == i) for i in range(3)]
+        times = sorted(p for _, p in pauses) or [0.0]
+        print('  %-12s collections gen0/1/2 %d/%d/%d  total %.2f ms  median %.3f ms  max %.3f ms  net blocks/cycle %.0f  (%d cycles)' % (
+            'low-latency' if mode == '1' else 'default', gens[0], gens[1], gens[2], sum(times) * 1000.0,
+            times[len(times) // 2] * 1000.0, times[-1] * 1000.0, per_cycle, len(res['cycles'])), file=out)
+    print('  (low-latency max is the one full collection made before freezing; the rest run between cycles)', file=out)
+
+def backend_bench(n, out=sys.stdout):
+    # Injects real events, so run it on a throwaway display: xvfb-run -a python bench_smkb.py --backends 2000
+    if not os.environ.get('DISPLAY'):
+        print('--backends needs an X display; run it under xvfb-run -a', file=out)
+        return 1
+    backends = [('pynput', SMKB.AutoController(), None)]
+    try:
+        xt = SMKB.XTestBackend()
+    except (OSError, AttributeError) as e:
+        print('xtest unavailable: %s' % e, file=out)
+    else:
+        backends.append(('xtest', SMKB.AutoController(xt.keyboard, xt.mouse), xt))
+    print('%-8s %-20s %12s %14s' % ('backend', 'operation', 'us/event', 'events/s'), file=out)
+    for name, ctl, xt in backends:
+        eng = SMKB.Engine(ctl, clock=_NullClock())
+        def moves():
+            for i in range(n):
+                ctl.mc.position = (i % 500, (i * 7) % 400)
+        def keys():
+            for _ in range(n):
+                ctl.kc.press(SMKB.Key.shift)
+                ctl.kc.release(SMKB.Key.shift)
+        def move_loop():
+            ctl.mc.position = (0, 0)
+            eng._last_mouse_target = None
+            eng._mouse_move_to((600, 400), 0, n * 8, 'ease-out', (0, 0), (0, 0))
+        for label, fn, events in (('position set', moves, n), ('key press+release', keys, 2 * n), ('_mouse_move_to', move_loop, n)):
+            t0 = time.perf_counter()
+            fn()
+            if xt is not None:
+                xt.sync()
+            dt = time.perf_counter() - t0
+            print('%-8s %-20s %12.2f %14.0f' % (name, label, dt / events * 1e6, events / dt), file=out)
+    return 0
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='SMKB parser and motion microbenchmarks')
+    ap.add_argument('--gc', type=int, default=None, metavar='CYCLES', help='compare GC pauses and per-cycle allocations with and without low-latency mode, then exit')
+    ap.add_argument('--backends', type=int, default=None, metavar='EVENTS', help='time pynput against the XTest backend on $DISPLAY, then exit')
+    ap.add_argument('--update-baseline', action='store_true', help='store these results as the new baseline')
+    ap.add_argument('--baseline', default=BASELINE_PATH, help='baseline file (default bench_baseline.json)')
+    ap.add_argument('--filter', default=None, help='only run benchmarks whose name contains this text')
+    ap.add_argument('--max-slowdown', type=float, default=0.25, help='fail when throughput drops by more than this fraction (default 0.25)')
+    ap.add_argument('--max-alloc-growth', type=float, default=0.25, help='fail when peak allocation grows by more than this fraction (default 0.25)')
+    args = ap.parse_args(argv)
+    if args.gc:
+        gc_report(args.gc)
+        return 0
+    if args.backends:
+        return backend_bench(args.backends)
+    results = run(build_cases(), args.filter)
+    if args.update_baseline:
+        data = {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': results,
+        }
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Wrote baseline with %d benchmarks to %s' % (len(results), args.baseline))
+        return 0
+    try:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+    failed = compare(results, baseline, args.max_slowdown, args.max_alloc_growth)
+    if failed:
+        print('%d benchmark(s) regressed: %s' % (len(failed), ', '.join(failed)))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,449 @@
+import enum
+import io
+import json
+import os
+import sys
+import types
+
+def _stub_pynput():
+    # Enough of pynput for SMKB to import on a headless CI box; the tests only
+    # drive the simulated backends.
+    class KeyCode:
+        def __init__(self, vk=None, char=None):
+            self.vk = vk; self.char = char
+    Key = enum.Enum('Key', 'enter space tab esc backspace shift ctrl alt cmd caps_lock up down left right home end '
+                    'page_up page_down insert delete f1 f2 f3 f4 f5 f6 f7 f8 f9 f10 f11 f12')
+    Button = enum.Enum('Button', 'left right middle')
+    class Controller:
+        position = (0, 0)
+        def press(self, k): pass
+        def release(self, k): pass
+        def click(self, b, count=1): pass
+    class GlobalHotKeys:
+        def __init__(self, mapping): pass
+        def start(self): pass
+        def stop(self): pass
+    kb = types.ModuleType('pynput.keyboard')
+    kb.Key, kb.KeyCode, kb.Controller, kb.GlobalHotKeys = Key, KeyCode, Controller, GlobalHotKeys
+    ms = types.ModuleType('pynput.mouse')
+    ms.Button, ms.Controller = Button, Controller
+    pkg = types.ModuleType('pynput')
+    pkg.keyboard, pkg.mouse = kb, ms
+    sys.modules.update({'pynput': pkg, 'pynput.keyboard': kb, 'pynput.mouse': ms})
+
+try:
+    import pynput  # noqa: F401
+except Exception:
+    _stub_pynput()
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import SMKB
+
+def test_compiled_type_chant_round_trip(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    chant = 'type="hi there\\n"|cps=40 ; a'
+    (src / 'x.chant').write_text(chant, encoding='utf-8')
+    out = io.StringIO()
+    rc = SMKB.lint_paths([str(src)], jobs=1, emit_dir=str(tmp_path / 'out'), out=out)
+    assert rc == 0, out.getvalue()
+    artifact = tmp_path / 'out' / 'x.chant.json'
+    json.loads(artifact.read_text(encoding='utf-8'))
+    steps = SMKB.load_compiled_chant(str(artifact))
+    assert steps == SMKB.parse_chant(chant)
+    direct = SMKB.simulate_chant(chant, 2)
+    loaded = SMKB.simulate_chant(steps, 2)
+    assert loaded['finished'] and not loaded['errors']
+    assert loaded['cycles'] == direct['cycles']
+    assert [e[1:] for e in loaded['events']] == [e[1:] for e in direct['events']]
+
+def test_daemon_drops_subscriber_that_stops_reading(tmp_path):
+    import socket, tempfile, threading, time
+    eng = SMKB.Engine(SMKB.AutoController(SMKB.SimKeyboard(SMKB.VirtualClock(), []), SMKB.SimMouse(SMKB.VirtualClock(), [])))
+    path = os.path.join(tempfile.mkdtemp(dir='/tmp'), 's')
+    daemon = SMKB.ControlDaemon(eng, path)
+    threading.Thread(target=daemon.serve_forever, daemon=True).start()
+    while daemon._server is None or not os.path.exists(path):
+        time.sleep(0.01)
+    try:
+        cli = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        cli.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        cli.connect(path)
+        cli.sendall(b'{"cmd":"subscribe"}\n')
+        assert json.loads(cli.makefile().readline())['ok']
+        dropped = SMKB._M_SUBS_DROPPED.value
+        # The client never reads again; emitting must not block the caller.
+        done = threading.Event()
+        def flood():
+            for i in range(2000):
+                eng._emit('cycle', seconds=i, pad='x' * 4096)
+            done.set()
+        threading.Thread(target=flood, daemon=True).start()
+        assert done.wait(10)
+        assert not daemon._subs
+        assert SMKB._M_SUBS_DROPPED.value == dropped + 1
+        cli.close()
+    finally:
+        daemon._server.shutdown()
+
+def test_arbiter_slot_kept_while_lanes_run():
+    class Recorder:
+        def __init__(self):
+            self.calls = []
+        def acquire(self, est_ms, stop_event=None, busy=False):
+            self.calls.append(('acquire', est_ms, busy))
+            return 0.0
+        def release(self, force=False):
+            self.calls.append(('release', force))
+    chant = 'a|hold=5000|lane=x ; b|hold=5000|lane=x ; c'
+    assert SMKB.estimate_step_ms(SMKB.parse_chant(chant)) == [5000, 10000, 10000]
+    clock = SMKB.VirtualClock()
+    eng = SMKB.Engine(SMKB.AutoController(SMKB.SimKeyboard(clock, []), SMKB.SimMouse(clock, [])), clock=clock)
+    eng.rng = SMKB.random.Random(0)
+    eng.apply_settings({'global_fixed_ms': '0'})
+    eng.load_chant(chant)
+    eng.arbiter = rec = Recorder()
+    stop = SMKB.threading.Event()
+    eng.add_listener(lambda event, data: event == 'cycle' and stop.set())
+    assert clock.run(eng._job, (stop,), stop_event=stop, until=60.0)
+    # Lane x is still holding a when b and c ask for the slot, and the slot is
+    # only returned after the end-of-cycle sync (then again on exit).
+    assert rec.calls == [('acquire', 5000, False), ('acquire', 10000, True), ('acquire', 10000, True),
+                         ('release', False), ('release', True)]
+
+def _start_arbiter(**kw):
+    import tempfile, threading
+    arb = SMKB.InputArbiter(**kw)
+    path = os.path.join(tempfile.mkdtemp(dir='/tmp'), 'arb')
+    threading.Thread(target=arb.serve_forever, args=(path,), daemon=True).start()
+    _wait_for(lambda: arb._server is not None and os.path.exists(path))
+    return arb, path
+
+def test_arbiter_client_renews_expired_slice_while_busy():
+    import time
+    arb, path = _start_arbiter(grace_ms=100)
+    try:
+        a, b = SMKB.ArbiterClient(path, 'a'), SMKB.ArbiterClient(path, 'b')
+        assert a.acquire(50) is not None
+        time.sleep(0.1)
+        # Lanes still running: the lease is extended, not handed over.
+        assert a.acquire(300, busy=True) == 0.0 and a.holding
+        assert arb.handle({'cmd': 'status'})['owner'] == 'a'
+        a.release(force=True)
+        assert b.acquire(10) is not None
+        assert arb.instances['a']['grants'] == 1 and arb.instances['a']['revoked'] == 0
+    finally:
+        arb._server.shutdown()
+
+def test_arbiter_drops_cancelled_waiters_and_revokes_hung_owners():
+    import threading, time
+    arb, path = _start_arbiter(grace_ms=100)
+    try:
+        owner, quitter, waiter = (SMKB.ArbiterClient(path, n) for n in ('owner', 'quitter', 'waiter'))
+        assert owner.acquire(400) is not None
+        stop = threading.Event()
+        res = []
+        t = threading.Thread(target=lambda: res.append(quitter.acquire(10, stop)))
+        t.start()
+        _wait_for(lambda: arb.handle({'cmd': 'status'})['waiting'] == 1)
+        stop.set()
+        t.join(5)
+        assert res == [None] and not quitter.holding
+        _wait_for(lambda: arb.handle({'cmd': 'status'})['waiting'] == 0)
+        # The owner never releases: the next waiter gets the slot after est_ms + grace.
+        t0 = time.perf_counter()
+        assert waiter.acquire(10) is not None
+        assert time.perf_counter() - t0 < 1.0
+        st = arb.handle({'cmd': 'status'})
+        assert st['owner'] == 'waiter'
+        assert st['instances']['quitter']['grants'] == 0 and st['instances']['quitter']['cancelled'] == 1
+        assert st['instances']['owner']['revoked'] == 1
+        # The revoked owner cannot renew; it queues again (and gets the slot
+        # once the waiter's own lease lapses).
+        assert owner.acquire(10, busy=True) is not None
+        assert arb.instances['owner']['grants'] == 2 and arb.instances['waiter']['revoked'] == 1
+    finally:
+        arb._server.shutdown()
+
+def test_lint_reports_per_file_failures(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    (src / 'bad.chant').write_text('a', encoding='utf-8')
+    (src / 'good.chant').write_text('b', encoding='utf-8')
+    emit = tmp_path / 'out'
+    # A directory where the artifact should go makes the emit fail for that file only.
+    (emit / 'bad.chant.json').mkdir(parents=True)
+    out = io.StringIO()
+    assert SMKB.lint_paths([str(src)], jobs=1, emit_dir=str(emit), out=out) == 1
+    assert '%s:1:1: error: lint failed: IsADirectoryError' % (src / 'bad.chant') in out.getvalue()
+    assert '1 errors' in out.getvalue()
+    assert sorted(os.listdir(emit)) == ['bad.chant.json', 'good.chant.json']
+    assert (emit / 'bad.chant.json').is_dir()
+
+def test_negative_modifiers_are_ignored():
+    for chant, same in (('mouse|rel=90|dist=-3|hold=-5|move=-1', 'mouse|rel=90'),
+                        ('mouse|dist=70|dist=-3', 'mouse|dist=70'),
+                        ('a|hold=50|hold=-20', 'a|hold=50')):
+        steps = SMKB.parse_chant(chant)
+        for a, b in zip(steps[0], SMKB.parse_chant(same)[0]):
+            assert dict(a, raw=None) == dict(b, raw=None)
+        warnings = [d[3] for d in SMKB.lint_chant(chant)['diagnostics']]
+        assert warnings and all(w.startswith('negative ') and w.endswith(' is ignored') for w in warnings)
+
+def _wait_for(cond, timeout=5.0):
+    import time
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.005)
+
+def test_pause_hands_back_the_arbiter_slot():
+    import threading, time
+    class Recorder:
+        holding = False
+        def __init__(self):
+            self.calls = []
+        def acquire(self, est_ms, stop_event=None, busy=False):
+            self.calls.append('acquire')
+            self.holding = True
+            return 0.0
+        def release(self, force=False):
+            self.calls.append('release')
+            self.holding = False
+    kb = SMKB.SimKeyboard(SMKB.RealClock(), [])
+    eng = SMKB.Engine(SMKB.AutoController(kb, SMKB.SimMouse(SMKB.RealClock(), [])))
+    eng.load_chant('a|hold=300 ; b|hold=300')
+    eng.arbiter = rec = Recorder()
+    eng.start()
+    try:
+        _wait_for(lambda: rec.holding)
+        assert eng.pause()
+        assert not rec.holding and rec.calls[-1] == 'release'
+        n = len(rec.calls)
+        time.sleep(0.4)
+        # Nothing asks for the slot while paused.
+        assert not rec.holding and len(rec.calls) == n
+        assert eng.resume()
+        assert rec.holding and rec.calls[n] == 'acquire'
+    finally:
+        eng.stop()
+
+README_FARM = 'mouse|hold=14000|button=left || a|hold=14000 ; mouse|rel=180|dist=50|move=1000; mouse|hold=14000|button=left || a|hold=14000 ; stop'
+
+def _held(events, name):
+    # (press time, release time) pairs for one key or button.
+    spans, down = [], None
+    for t, _, op, what in events:
+        if what != name:
+            continue
+        if op == 'press':
+            down = t
+        elif op == 'release':
+            spans.append((down, t))
+    return spans
+
+def test_readme_farm_cycle_time():
+    res = SMKB.simulate_chant(README_FARM)
+    assert res['finished'] and not res['errors']
+    est_s = SMKB.estimate_chant_ms(SMKB.parse_chant(README_FARM), 200, 100) / 1000.0
+    assert 28.0 < res['duration_s'] < 31.0
+    # Ending on stop still counts as a completed cycle.
+    assert len(res['cycles']) == 1 and abs(res['cycles'][0] - est_s) < 0.5
+    for name in ('a', 'left'):
+        spans = _held(res['events'], name)
+        assert len(spans) == 2
+        assert all(abs((up - down) - 14.0) < 0.2 for down, up in spans)
+
+def test_lane_chant_overlaps_and_syncs():
+    chant = 'mouse|hold=14000|button=left|lane=click || a|hold=14000|lane=key ; mouse|rel=180|dist=50|move=1000|@+500 ; sync ; stop'
+    res = SMKB.simulate_chant(chant)
+    assert res['finished'] and not res['errors']
+    # The turn runs inside the holds instead of after them.
+    assert 14.0 < res['duration_s'] < 15.0
+    (a_down, a_up), = _held(res['events'], 'a')
+    moves = [t for t, dev, op, _ in res['events'] if dev == 'mouse' and op == 'move']
+    assert moves and a_down < moves[0] and moves[-1] < a_up
+    # sync waits for both lanes: nothing happens after the last release.
+    assert max(a_up, _held(res['events'], 'left')[0][1]) == res['events'][-1][0]
+
+def test_type_chant_presses():
+    res = SMKB.simulate_chant('type="Hi, gg\\n"|cps=20 ; stop')
+    assert res['finished'] and not res['errors']
+    presses = [e[3] for e in res['events'] if e[2] == 'press']
+    assert presses == ['shift', 'h', 'i', ',', 'space', 'g', 'g', 'enter']
+    assert len([e for e in res['events'] if e[2] == 'release']) == len(presses)
+    assert _held(res['events'], 'shift') == [(0.0, 0.0)]
+    starts = sorted({round(t, 6) for t, _, op, what in res['events'] if op == 'press' and what != 'shift'})
+    assert all(abs((b - a) - 0.05) < 1e-6 for a, b in zip(starts, starts[1:]))
+
+def test_apply_settings_converts_and_rejects():
+    import pytest
+    eng = SMKB.Engine(SMKB.AutoController(SMKB.SimKeyboard(SMKB.VirtualClock(), []), SMKB.SimMouse(SMKB.VirtualClock(), [])))
+    eng.apply_settings({'enable_mouse': '0', 'enable_kb': 'true', 'global_fixed_ms': 50, 'kb_mode': 'Rate', 'kb_param': 12.5})
+    assert eng.enable_mouse.get() == 0 and eng.enable_kb.get() == 1
+    assert eng.global_fixed_ms.get() == '50' and eng.kb_mode.get() == 'rate' and eng.kb_param.get() == '12.5'
+    for bad in ({'enable_mouse': 'maybe'}, {'global_fixed_ms': '-5'}, {'global_fixed_ms': 'fast'}, {'global_jitter': '20,10'},
+                {'kb_mode': 'turbo'}, {'mouse_pos': '5'}, {'kb_param': '0'}, {'chant_text': [1]}, {'nope': 1}):
+        with pytest.raises(ValueError):
+            eng.apply_settings(dict(bad, move_dur='300'))
+    assert eng.move_dur.get() == '200'
+    # The sequence loop (no chant) must honour a string "0".
+    res = SMKB.simulate_chant('', 1, {'enable_mouse': '0', 'kb_sequence': 'a', 'mouse_pos': '5,5'})
+    assert res['events'] and all(e[1] == 'kb' for e in res['events'])
+
+def test_daemon_rejects_bad_load_without_stopping():
+    eng = SMKB.Engine(SMKB.AutoController(SMKB.SimKeyboard(SMKB.VirtualClock(), []), SMKB.SimMouse(SMKB.VirtualClock(), [])))
+    daemon = SMKB.ControlDaemon(eng, '/nonexistent')
+    stopped = []
+    eng.stop = lambda: stopped.append(1) or True
+    for msg in ({'cmd': 'load', 'chant': 123}, {'cmd': 'load', 'file': 5}, {'cmd': 'load', 'chant': 'a', 'settings': [1]},
+                {'cmd': 'load', 'chant': 'a', 'settings': {'nope': 1}}, {'cmd': 'load', 'chant': 'a', 'settings': {'enable_kb': 'x'}}):
+        reply = daemon.handle(msg)
+        assert reply['ok'] is False and reply['error'], msg
+    assert daemon.handle({'cmd': 'load', 'chant': 'a', 'settings': {'nope': 1}})['error'] == 'unknown setting(s): nope'
+    assert not stopped
+
+def test_literal_quote_key():
+    assert [a['keys'] for a in SMKB.parse_sequence('a,",b')] == [['a'], ['"'], ['b']]
+    assert [[a['keys'] for a in st] for st in SMKB.parse_chant('shift+" ; a ; b')] == [[[SMKB.Key.shift, '"']], [['a']], [['b']]]
+    steps = SMKB.parse_chant('" ; type="x;y"|cps=5 ; "|hold=20')
+    assert [st[0].get('type') for st in steps] == [None, 'x;y', None]
+    assert steps[2][0]['keys'] == ['"'] and steps[2][0]['hold'] == 20
+    assert not SMKB.lint_chant('shift+" ; a ; type="x;y"')['diagnostics']
+
+def test_daemon_resume_does_not_wait_for_the_slot():
+    import threading
+    granted = threading.Event()
+    class SlowArbiter:
+        def acquire(self, est_ms, stop_event=None, busy=False):
+            granted.wait(5)
+            return 0.0
+        def release(self, force=False):
+            pass
+    eng = SMKB.Engine(SMKB.AutoController(SMKB.SimKeyboard(SMKB.RealClock(), []), SMKB.SimMouse(SMKB.RealClock(), [])))
+    eng.load_chant('a|hold=50')
+    eng.start()
+    try:
+        _wait_for(lambda: eng.cycles or eng._pc is not None)
+        assert eng.pause()
+        eng.arbiter = SlowArbiter()
+        daemon = SMKB.ControlDaemon(eng, '/nonexistent')
+        assert daemon.handle({'cmd': 'resume'}) == {'ok': True, 'resumed': True, 'state': 'resuming'}
+        assert eng.paused and eng.status()['resuming']
+        granted.set()
+        _wait_for(lambda: eng.state() == 'running')
+    finally:
+        granted.set()
+        eng.stop()
+
+def test_resume_latency_is_taken_at_the_first_input():
+    import time
+    h = SMKB._M_RESUME_LATENCY
+    kb = SMKB.SimKeyboard(SMKB.RealClock(), [])
+    ctl = SMKB.AutoController(kb, SMKB.SimMouse(SMKB.RealClock(), []))
+    ctl.running = True
+    n, total = h.count, h.sum
+    # A pause with no input in between leaves no sample behind.
+    assert ctl.pause() and ctl.resume() and ctl.pause()
+    assert h.count == n
+    t0 = time.perf_counter()
+    assert ctl.resume(t0)
+    time.sleep(0.05)
+    ctl.kc.press('a')
+    ctl.kc.release('a')
+    assert h.count == n + 1 and h.sum - total >= 0.05
+
+def test_stop_records_the_cycle_metrics():
+    n, drift = SMKB._M_CYCLES.value, SMKB._M_CYCLE_DRIFT.count
+    res = SMKB.simulate_chant('a|hold=100 ; stop')
+    assert len(res['cycles']) == 1
+    assert SMKB._M_CYCLES.value == n + 1 and SMKB._M_CYCLE_DRIFT.count == drift + 1
+
+def test_xtest_keeps_a_held_shift():
+    import contextlib
+    SHIFT, A = 50, 38
+    class FakeBackend:
+        shift_code, shift_codes = SHIFT, {SHIFT, 62}
+        def __init__(self):
+            self.events = []
+        def keycode(self, key):
+            return {SMKB.Key.shift: (SHIFT, False), 'a': (A, False), 'A': (A, True)}[key]
+        def batch(self):
+            return contextlib.nullcontext()
+        def fake_key(self, code, down):
+            self.events.append((code, down))
+    be = FakeBackend()
+    kb = SMKB.XTestKeyboard(be)
+    kb.press('A'); kb.release('A')
+    assert be.events == [(SHIFT, True), (A, True), (A, False), (SHIFT, False)]
+    del be.events[:]
+    kb.press(SMKB.Key.shift); kb.press('A'); kb.release('A')
+    assert be.events == [(SHIFT, True), (A, True), (A, False)]
+    kb.release(SMKB.Key.shift)
+    assert be.events[-1] == (SHIFT, False)
+
+def test_x_error_handler_counts_and_continues():
+    import ctypes
+    n = SMKB._M_X_ERRORS.value
+    ev = SMKB._XErrorEvent(error_code=2, request_code=132, minor_code=2)
+    assert SMKB._X_ERROR_HANDLER(None, ctypes.pointer(ev)) == 0
+    assert SMKB._M_X_ERRORS.value == n + 1
+
+def test_validator_cache_covers_long_chants(monkeypatch):
+    calls = []
+    lint_part = SMKB.lint_part
+    monkeypatch.setattr(SMKB, 'lint_part', lambda part: calls.append(part) or lint_part(part))
+    v = SMKB.ChantValidator(max_cache=64)
+    chant = ' ; '.join('a|hold=%d' % i for i in range(300))
+    v.validate(chant)
+    assert len(calls) == 300
+    del calls[:]
+    edited = chant.replace('a|hold=150', 'b|hold=150')
+    v.validate(edited)
+    assert calls == ['b|hold=150']
+    # The replaced part is still in the spare room, so undoing the edit is free.
+    del calls[:]
+    v.validate(chant)
+    assert calls == []
+
+def test_cpu_list_is_a_usage_error():
+    import pytest
+    assert SMKB.parse_args(['--cpu', '2-3,5']).cpu == [2, 3, 5]
+    for bad in ('a', '3-1', '-1', ''):
+        with pytest.raises(SystemExit) as e:
+            SMKB.parse_args(['--cpu', bad])
+        assert e.value.code == 2
+
+def test_type_estimate_matches_simulation():
+    for chant in ('type="Hello"|cps=10 ; stop', 'type="Hello"|cps=10|repeat=2 ; a ; stop', 'type="x"|cps=5 ; stop'):
+        est_s = SMKB.estimate_chant_ms(SMKB.parse_chant(chant), 200, 100) / 1000.0
+        res = SMKB.simulate_chant(chant)
+        assert abs(res['cycles'][0] - est_s) < 0.02, chant
+
+def test_lint_warns_on_sync_for_unknown_lane():
+    chant = 'a|hold=500|lane=key ; b ; sync=kye,key ; sync=Key || c'
+    start = chant.index('kye')
+    expected = [(start, start + 3, 'warning', "sync waits for lane 'kye', which no action uses")]
+    assert SMKB.lint_chant(chant)['diagnostics'] == expected
+    assert SMKB.ChantValidator().validate(chant)[1] == expected
+    assert not SMKB.lint_chant('a|lane=x ; sync ; sync=x')['diagnostics']
+
+def test_rate_mode_holds_rate_with_dispatch_cost(monkeypatch):
+    def slow_press(self, k):
+        self.events.append((self.clock.now(), 'kb', 'press', SMKB._input_name(k)))
+        self.clock.sleep(0.005)
+    monkeypatch.setattr(SMKB.SimKeyboard, 'press', slow_press)
+    settings = {'enable_mouse': '0', 'kb_mode': 'rate', 'kb_param': '50', 'kb_sequence': 'a'}
+    res = SMKB.simulate_chant('', 1, settings, max_virtual_s=4.0)
+    t = [e[0] for e in res['events'] if e[2] == 'press']
+    dt = [b - a for a, b in zip(t, t[1:])]
+    assert abs((len(t) - 1) / (t[-1] - t[0]) - 50.0) < 0.5
+    assert max(dt) - min(dt) < 0.002
+
+def test_rate_mode_types_text():
+    settings = {'enable_mouse': '0', 'kb_mode': 'rate', 'kb_param': '20', 'kb_sequence': 'type="Hi"'}
+    res = SMKB.simulate_chant('', 1, settings, max_virtual_s=0.49)
+    assert [e[3] for e in res['events'][:6]] == ['shift', 'h', 'h', 'shift', 'i', 'i']
+    presses = [e[0] for e in res['events'] if e[2] == 'press' and e[3] != 'shift']
+    assert len(presses) == 10
+    assert abs(presses[1] - presses[0] - 0.05) < 1e-6